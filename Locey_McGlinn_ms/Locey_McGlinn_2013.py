@@ -104,7 +104,7 @@ def time_trials_sage():
             times = []
             for n in ns:
                 zeros=False
-                D = {}    
+                D = parts.CountTable()    
                 with Timer() as t:
                     x = parts.rand_partitions(q, n, sample_size, name, D, zeros)
                 times.append(round(t.interval,2))
@@ -171,7 +171,7 @@ def time_trials_bigQ(  ):
         for ii, name in enumerate(algorithms):
             times = []
             for n in ns:
-                D = {}
+                D = parts.CountTable()
                 with Timer() as t:
                     x = parts.rand_partitions(q, n, sample_size, name, D, zeros=False)
                 times.append(round(t.interval,2))
@@ -333,10 +333,10 @@ def kdens_unbias():
         for i, alg in enumerate(algs):
             if nplot == 1 or nplot == 3:
                 zeros = False
-                D = {}
+                D = parts.CountTable()
                 partitions = parts.rand_partitions(q, n, sample_size, alg, D, zeros)
             else:
-                D = {}
+                D = parts.CountTable()
                 zeros = True
                 partitions = parts.rand_partitions(q, n, sample_size, alg, D, zeros)
                 
@@ -478,7 +478,7 @@ def get_all_SSADs(qnlist): # Figure X Locey and McGlinn (2013)
         
         sample_size = s_size
         zeros = True    
-        D = {}
+        D = parts.CountTable()
         name = 'divide_and_conquer'
         SSADs = parts.rand_partitions(q, n, sample_size, name, D, zeros)
         
@@ -511,7 +511,7 @@ def get_all_SSADs(qnlist): # Figure X Locey and McGlinn (2013)
         clr = colors[ind]
         sample_size = s_size
         zeros = True    
-        D = {}
+        D = parts.CountTable()
         name = 'divide_and_conquer'
         partitions = parts.rand_partitions(q, n, sample_size, name, D, zeros)
             
@@ -533,7 +533,7 @@ def get_all_SSADs(qnlist): # Figure X Locey and McGlinn (2013)
         clr = colors[ind]
         sample_size = s_size
         zeros = False    
-        D = {}
+        D = parts.CountTable()
         name = 'divide_and_conquer'
         
         RADs = parts.rand_partitions(q, n, sample_size, name, D, zeros)
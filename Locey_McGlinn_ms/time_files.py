@@ -34,7 +34,7 @@ for zero in zeros:
                 print alg, zero, alg, q
                 
                 times = []
-                D = {}    
+                D = parts.CountTable()
                 t0 = time.time()
                 x = parts.rand_partitions(q, n, sample_size, alg, D, zeros)
                 t = time.time() - t0
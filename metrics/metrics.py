@@ -6,28 +6,87 @@ from scipy import stats
 import re
 import math
 import random, decimal
+import csv
+import pypartitions as parts
 
 
 """ functions for calculating statistical metrics for vectors of integers """
 
-def get_kdens_obs(partitions, metric):
+def get_kdens_obs(partitions, metric, gridsize=None):
+    """ Finds the kernel density function of a metric across a sample of
+    partitions. If gridsize is given, the density is found by fft_kde() at
+    gridsize points, instead of by gaussian_kde at one point per partition """
 
     if metric == 'gini':
-        D = get_kdens_obs_gini(partitions) # inequality
+        D = get_kdens_obs_gini(partitions, gridsize) # inequality
     
     elif metric == 'evar':
-        D = get_kdens_obs_Evar(partitions) # Evar cannot be calculated when zeros = True
+        D = get_kdens_obs_Evar(partitions, gridsize) # Evar cannot be calculated when zeros = True
     
     elif metric == 'median':
-        D = get_kdens_obs_MD(partitions)
+        D = get_kdens_obs_MD(partitions, gridsize)
     
     elif metric == 'variance':
-        D = get_kdens_obs_var(partitions) # variance
+        D = get_kdens_obs_var(partitions, gridsize) # variance
     
     elif  metric == 'skewness':
-        D = get_kdens_obs_skew(partitions) # skewness
+        D = get_kdens_obs_skew(partitions, gridsize) # skewness
     
     return D
+
+
+def kdens(values, lo, hi, gridsize=None):
+    """ The kernel density of values, with covariance_factor 0.5, at evenly
+    spaced points from lo to hi, as [xs, density]. Without gridsize, it is
+    found by gaussian_kde at one point per value; with gridsize, by fft_kde()
+    at gridsize points """
+    if gridsize is None:
+        density = gaussian_kde(values)
+        n = len(values)
+        xs = np.linspace(lo,hi,n)
+        density.covariance_factor = lambda : .5
+        density._compute_covariance()
+        return [xs,density(xs)]
+    xs = np.linspace(lo,hi,gridsize)
+    return [xs,fft_kde(values, xs)]
+
+
+def fft_kde(values, xs, factor=0.5):
+    """ The Gaussian kernel density of values at the points xs, with the
+    bandwidth of gaussian_kde with covariance_factor = factor, i.e. a kernel
+    standard deviation of factor times the sample standard deviation.
+    
+    The values are binned onto a fine grid, each split between its two nearest
+    grid points in proportion to its nearness, and the binned counts are
+    convolved with the kernel by FFT, in O(G log G) for G grid points instead
+    of O(len(values) * len(xs)). The density is then interpolated at xs. The
+    grid reaches 4 bandwidths past the values and xs, and has at least 8
+    points per bandwidth. """
+    values = np.asarray(values, dtype=float)
+    xs = np.asarray(xs, dtype=float)
+    N = len(values)
+    sigma = factor * np.std(values, ddof=1)
+    if not sigma > 0:
+        raise np.linalg.LinAlgError('the values have no spread')
+    
+    lo = min(values.min(), xs.min()) - 4 * sigma
+    hi = max(values.max(), xs.max()) + 4 * sigma
+    G = int(min(2**22, max(1024, 8 * (hi - lo) / sigma)))
+    dx = (hi - lo) / (G - 1)
+    pos = (values - lo) / dx
+    i = np.minimum(np.floor(pos).astype(np.int64), G - 2)
+    w = pos - i
+    counts = np.bincount(i, 1 - w, minlength=G) + np.bincount(i + 1, w, minlength=G)
+    
+    K = min(G - 1, int(math.ceil(4 * sigma / dx)))
+    offsets = np.arange(-K, K + 1) * dx
+    kernel = np.exp(-0.5 * (offsets / sigma)**2) / (sigma * math.sqrt(2 * math.pi))
+    L = G + 2 * K
+    size = 1 << (L - 1).bit_length()
+    density = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    density = density[K:K + G] / N
+    grid = lo + np.arange(G) * dx
+    return np.interp(xs, grid, density)
     
 
 def simplest_gini(x): #x is a vector of integers
@@ -48,108 +107,669 @@ def simplest_gini(x): #x is a vector of integers
     
 def gini_sample(SADs):
     """ Compute Gini's coefficient for each macrostate in a random sample """
+    if _is_array(SADs):
+        return gini_array(SADs).tolist()
     Gs = []
     for sad in SADs:
         G = simplest_gini(sad)
         Gs.append(G)
     return Gs
-def get_kdens_obs_gini(partitions):
+def get_kdens_obs_gini(partitions, gridsize=None):
     """ Finds the kernel density function across a sample of partitions 
         for a given total (N) and number of parts (S) """
     ginis = gini_sample(partitions)
-    density = gaussian_kde(ginis)
-    n = len(ginis)
-    xs = np.linspace(0.0,1.0,n)
-    density.covariance_factor = lambda : .5
-    density._compute_covariance()
-    D = [xs,density(xs)]
+    D = kdens(ginis, 0.0, 1.0, gridsize)
     return D
 
 def e_var(partition):
     """ Calculate Smith and Wilson's evenness index Evar """
     P = np.log(partition)
     S = len(partition)
+    mean = np.mean(P)
     X = 0
     for x in P:
-        X += (x - np.mean(P))**2/S
+        X += (x - mean)**2/S
     evar = 1 - 2/math.pi*np.arctan(X) 
     return(evar)    
 
 
 def vars_sample(partitions):
     """ Compute Evar for each partition in a random sample of partitions for N and S"""
+    if _is_array(partitions):
+        return var_array(partitions).tolist()
     _vars = []
     for partition in partitions:
         _var = np.var(partition)
         _vars.append(_var)
     return _vars
-def get_kdens_obs_var(partitions):
+def get_kdens_obs_var(partitions, gridsize=None):
     """ Finds the kernel density function across a sample of partitions 
         for a given total (N) and number of parts (S) """
     _vars = vars_sample(partitions)
-    density = gaussian_kde(_vars)
-    n = len(_vars)
     _min = min(_vars)
     _max = max(_vars)
-    xs = np.linspace(_min,_max,n)
-    density.covariance_factor = lambda : .5
-    density._compute_covariance()
-    D = [xs,density(xs)]
+    D = kdens(_vars, _min, _max, gridsize)
     return D
 
 
 
 def Evars_sample(partitions):
     """ Compute Evar for each partition in a random sample of partitions for N and S"""
+    if _is_array(partitions):
+        return e_var_array(partitions).tolist()
     Evars = []
     for partition in partitions:
         Evar = e_var(partition)
         Evars.append(Evar)
     return Evars
-def get_kdens_obs_Evar(partitions):
+def get_kdens_obs_Evar(partitions, gridsize=None):
     """ Finds the kernel density function across a sample of partitions 
         for a given total (N) and number of parts (S) """
     Evars = Evars_sample(partitions)
-    density = gaussian_kde(Evars)
-    n = len(Evars)
-    xs = np.linspace(0.0,1.0,n)
-    density.covariance_factor = lambda : .5
-    density._compute_covariance()
-    D = [xs,density(xs)]
+    D = kdens(Evars, 0.0, 1.0, gridsize)
     return D
 
 """ functions for statistical skewness """
 def get_skews(partitions):
     """ Find the statistical skewnness for each integer partition in a sample """
+    if _is_array(partitions):
+        return skew_array(partitions).tolist()
     skews = []
     for partition in partitions:
         skews.append(stats.skew(partition))
     return skews
-def get_kdens_obs_skew(partitions):
+def get_kdens_obs_skew(partitions, gridsize=None):
     """ Finds the kernel density function for the statistical skewnness across a sample of integer partitions for a given N and S """
     skews = get_skews(partitions)
-    density = gaussian_kde(skews)
-    n = len(skews)
-    xs = np.linspace(float(min(skews)),float(max(skews)),n)
-    density.covariance_factor = lambda : .5
-    density._compute_covariance()
-    D = [xs,density(xs)]
+    D = kdens(skews, float(min(skews)), float(max(skews)), gridsize)
     return D
 
 """ functions for examining median summand values across a sample of integer partitions """
-def get_kdens_obs_MD(partitions):
+def get_kdens_obs_MD(partitions, gridsize=None):
     """ Finds the kernel density function for the median summmand across a sample of integer partitions for a given N and S """
     MDs = MDs_sample(partitions)
-    density = gaussian_kde(MDs)
-    n = len(MDs)
-    xs = np.linspace(0.0,float(max(MDs)),n)
-    density.covariance_factor = lambda : .5
-    density._compute_covariance()
-    D = [xs,density(xs)]
+    D = kdens(MDs, 0.0, float(max(MDs)), gridsize)
     return D
 def MDs_sample(partitions):
     """ find the median summand value for each integer partition in a sample """
+    if _is_array(partitions):
+        return median_array(partitions).tolist()
     MDs = []
     for partition in partitions:
         MDs.append(np.median(partition))
     return MDs
+
+
+""" functions for the metrics of every row of a (samples, n) array of
+    partitions at once, by numpy operations along the rows. Each gives the same
+    values as the function for a single partition. """
+
+def _is_array(partitions):
+    """ True if partitions is a 2-D numpy array, or a non-empty list (or tuple)
+    of vectors of equal length, i.e. can be handled by the *_array functions.
+    Anything else, e.g. a generator, is left to the loop over partitions """
+    if isinstance(partitions, np.ndarray):
+        return partitions.ndim == 2
+    if not isinstance(partitions, (list, tuple)) or len(partitions) == 0:
+        return False
+    n = len(partitions[0])
+    for partition in partitions:
+        if len(partition) != n:
+            return False
+    return n > 0
+
+
+def gini_array(partitions, ascending=None):
+    """ Gini's coefficient (as simplest_gini) of each row. ascending, if given,
+    is the array with each row sorted in increasing order """
+    if ascending is None:
+        ascending = np.sort(np.asarray(partitions, dtype=float), axis=1)
+    n = ascending.shape[1]
+    total = ascending.sum(axis=1)
+    ysum = np.cumsum(ascending, axis=1).sum(axis=1)
+    return 1 - 2 * ysum / (n * total)
+
+
+def var_array(partitions):
+    """ The variance (as np.var) of each row """
+    return np.var(np.asarray(partitions, dtype=float), axis=1)
+
+
+def e_var_array(partitions):
+    """ Smith and Wilson's evenness index Evar (as e_var) of each row """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        X = np.var(np.log(np.asarray(partitions, dtype=float)), axis=1)
+    return 1 - 2/math.pi*np.arctan(X)
+
+
+def skew_array(partitions):
+    """ The statistical skewness (as stats.skew) of each row, or NaN for a row
+    of equal values """
+    x = np.asarray(partitions, dtype=float)
+    d = x - x.mean(axis=1)[:, None]
+    d2 = d * d # not d**3, which numpy computes by the slow pow()
+    m2 = d2.mean(axis=1)
+    m3 = (d2 * d).mean(axis=1)
+    flat = m2 <= 0
+    skews = m3 / np.where(flat, 1, m2)**1.5
+    skews[flat] = np.nan
+    return skews
+
+
+def median_array(partitions, ascending=None):
+    """ The median value (as np.median) of each row. ascending, if given, is
+    the array with each row sorted in increasing order """
+    if ascending is None:
+        ascending = np.sort(np.asarray(partitions, dtype=float), axis=1)
+    n = ascending.shape[1]
+    return (ascending[:, (n - 1) // 2] + ascending[:, n // 2]) / 2
+
+
+def compute_all(partitions):
+    """ Every metric of each row of a (samples, n) array of partitions, from a
+    single sort of the array: a dictionary of arrays for 'gini', 'evar',
+    'variance', 'skewness' and 'median' """
+    ascending = np.sort(np.asarray(partitions, dtype=float), axis=1)
+    return {'gini': gini_array(None, ascending),
+            'evar': e_var_array(ascending),
+            'variance': var_array(ascending),
+            'skewness': skew_array(ascending),
+            'median': median_array(None, ascending)}
+
+
+""" functions for partitions in run-length form, i.e. lists of (value, count)
+    pairs as returned by pypartitions.rand_partitions(..., runs=True). Each takes
+    time in proportion to the number of distinct values, not the number of parts,
+    and gives the same value as the function for the expanded partition. """
+
+def gini_runs(runs):
+    """ Gini's coefficient of inequality (as simplest_gini) for a partition in
+    run-length form """
+    yn, ysum, countx = 0.0, 0.0, 0
+    for xn, c in sorted(runs):
+        # the c values of xn add yn + xn, yn + 2xn, ..., yn + c xn to ysum
+        ysum += c * yn + xn * c * (c + 1) / 2
+        yn += c * xn
+        countx += c
+    B = ysum / (countx * yn)
+    return(1 - 2*B)
+
+
+def mean_runs(runs):
+    """ The mean and number of values of a partition in run-length form """
+    S = 0
+    total = 0
+    for x, c in runs:
+        S += c
+        total += c * x
+    return total / S, S
+
+
+def var_runs(runs):
+    """ The variance (as np.var) of a partition in run-length form """
+    mean, S = mean_runs(runs)
+    X = 0.0
+    for x, c in runs:
+        X += c * (x - mean)**2
+    return X / S
+
+
+def e_var_runs(runs):
+    """ Smith and Wilson's evenness index Evar (as e_var) for a partition in
+    run-length form """
+    logs = [(np.log(x), c) for x, c in runs]
+    X = var_runs(logs)
+    evar = 1 - 2/math.pi*np.arctan(X)
+    return(evar)
+
+
+def median_runs(runs):
+    """ The median value (as np.median) of a partition in run-length form """
+    runs = sorted(runs)
+    S = 0
+    for x, c in runs:
+        S += c
+    lower = (S - 1) // 2 # positions, from 0, of the middle value(s)
+    upper = S // 2
+    seen = 0
+    low_value = None
+    for x, c in runs:
+        seen += c
+        if low_value is None and seen > lower:
+            low_value = x
+        if seen > upper:
+            return (low_value + x) / 2
+
+
+def skew_runs(runs):
+    """ The statistical skewness (as stats.skew) of a partition in run-length
+    form """
+    mean, S = mean_runs(runs)
+    m2, m3 = 0.0, 0.0
+    for x, c in runs:
+        m2 += c * (x - mean)**2
+        m3 += c * (x - mean)**3
+    m2 /= S
+    m3 /= S
+    if m2 == 0:
+        return np.nan
+    return m3 / m2**1.5
+
+
+
+""" functions for the exact distributions of the metrics across a feasible set,
+    found by streaming every partition through online accumulators, so memory
+    stays bounded however large the feasible set is """
+
+class Welford(object):
+    """ Online count, mean and variance of a stream of values, by Welford's
+    method. Blocks of values are added with the pairwise update of Chan et al.,
+    i.e. as if merging the moments of the block. NaN values are counted in nan
+    and otherwise ignored. """
+    
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.M2 = 0.0
+        self.nan = 0
+    
+    def add(self, x):
+        if x != x:
+            self.nan += 1
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.M2 += delta * (x - self.mean)
+    
+    def add_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        nans = np.isnan(xs)
+        self.nan += int(nans.sum())
+        xs = xs[~nans]
+        if len(xs) == 0:
+            return
+        count = self.count + len(xs)
+        mean = xs.mean()
+        delta = mean - self.mean
+        self.M2 += ((xs - mean)**2).sum() + delta**2 * self.count * len(xs) / count
+        self.mean += delta * len(xs) / count
+        self.count = count
+    
+    def merge(self, other):
+        """ Add the values of another Welford, e.g. from a parallel worker """
+        self.nan += other.nan
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.M2 += other.M2 + delta**2 * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        return self
+    
+    def variance(self):
+        """ The population variance (as np.var) of the values added """
+        if self.count == 0:
+            return np.nan
+        return self.M2 / self.count
+
+
+class Histogram(object):
+    """ Counts of a stream of values in bins of equal width from lo to hi.
+    Values below lo or above hi (by more than rounding error) are counted in
+    under and over, and NaN values in nan. """
+    
+    def __init__(self, lo, hi, bins=100):
+        if hi <= lo:
+            hi = lo + 1.0
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.under = 0
+        self.over = 0
+        self.nan = 0
+    
+    def add(self, x):
+        self.add_many([x])
+    
+    def add_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        nans = np.isnan(xs)
+        self.nan += int(nans.sum())
+        xs = xs[~nans]
+        lo, hi = self.edges[0], self.edges[-1]
+        tol = 1e-9 * (hi - lo) # rounding error at the edges is not out of range
+        self.under += int((xs < lo - tol).sum())
+        self.over += int((xs > hi + tol).sum())
+        xs = xs[(xs >= lo - tol) & (xs <= hi + tol)]
+        bins = len(self.counts)
+        i = np.clip(((xs - lo) / (hi - lo) * bins).astype(np.int64), 0, bins - 1)
+        self.counts += np.bincount(i, minlength=bins)
+    
+    def merge(self, other):
+        """ Add the counts of another Histogram with the same bins """
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('cannot merge histograms with different bins')
+        self.counts += other.counts
+        self.under += other.under
+        self.over += other.over
+        self.nan += other.nan
+        return self
+    
+    def density(self):
+        """ The bin centers and the density at each, in the form [xs, density]
+        returned by get_kdens_obs() """
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        width = self.edges[1] - self.edges[0]
+        total = self.counts.sum()
+        if total == 0:
+            return [centers, np.zeros(len(centers))]
+        return [centers, self.counts / (total * width)]
+
+
+class QuantileSketch(object):
+    """ A mergeable summary of the quantiles of a stream of values, after the
+    KLL sketch of Karnin, Lang and Liberty (2016). The values are kept in
+    levels, a value at level h standing for 2**h of the values added. When a
+    level holds more than its capacity, it is sorted and every other value,
+    from a random first one, moves up a level. The top level holds up to k
+    values and each level below it 2/3 as many, so the sketch holds O(k) values
+    however many are added, and the rank of a value is found to within about
+    2/k of the count. NaN values are counted in nan and otherwise ignored. """
+    
+    def __init__(self, k=200, rng=None):
+        self.k = k
+        self.rng = rng
+        self.levels = [np.zeros(0)]
+        self.count = 0
+        self.nan = 0
+    
+    def capacity(self, h):
+        depth = len(self.levels) - h - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3)**depth)))
+    
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                level = np.sort(self.levels[h])
+                keep = len(level) % 2 # an odd value out stays at this level
+                first = parts.randrange(self.rng, 0, 2)
+                self.levels[h + 1] = np.concatenate((self.levels[h + 1], level[keep + first::2]))
+                self.levels[h] = level[:keep]
+            h += 1
+    
+    def add(self, x):
+        self.add_many([x])
+    
+    def add_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        nans = np.isnan(xs)
+        self.nan += int(nans.sum())
+        xs = xs[~nans]
+        self.count += len(xs)
+        self.levels[0] = np.concatenate((self.levels[0], xs))
+        self.compress()
+    
+    def merge(self, other):
+        """ Add the values of another QuantileSketch, e.g. from a parallel
+        worker """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], level))
+        self.count += other.count
+        self.nan += other.nan
+        self.compress()
+        return self
+    
+    def weighted(self):
+        """ The values held, sorted, and the cumulative number each stands for """
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        return values[order], np.cumsum(weights[order])
+    
+    def quantile(self, p):
+        """ The value at quantile p (0 to 1), or at each of an array of them """
+        if self.count == 0:
+            return np.nan * np.asarray(p, dtype=float)
+        values, cum = self.weighted()
+        i = np.searchsorted(cum, np.asarray(p, dtype=float) * cum[-1], side='left')
+        return values[np.minimum(i, len(values) - 1)]
+    
+    def cdf(self, x):
+        """ The fraction of the values added that are no more than x, or than
+        each of an array of them """
+        if self.count == 0:
+            return np.nan * np.asarray(x, dtype=float)
+        values, cum = self.weighted()
+        i = np.searchsorted(values, np.asarray(x, dtype=float), side='right')
+        return np.where(i > 0, cum[np.maximum(i - 1, 0)], 0.0) / cum[-1]
+
+
+def metric_bounds(q, n):
+    """ The range of each metric across the partitions of q having n parts """
+    first = np.array([parts.first_lexical(q, n, None)])
+    if n > 2:
+        max_skew = (n - 2) / math.sqrt(n - 1)
+    else:
+        max_skew = 1.0
+    # simplest_gini() gives -1/n, not 0, for n equal parts
+    return {'gini': (-1.0 / n, 1.0), 'evar': (0.0, 1.0),
+            'variance': (0.0, float(np.var(first))),
+            'skewness': (-max_skew, max_skew),
+            'median': (1.0, float(q - n + 1))}
+
+
+def stream_distributions(partitions, q, n, bins=100, block=4096, k=200, rng=None):
+    """
+    Find the distribution of each metric (Gini's coefficient, Evar, variance,
+    skewness and the median) across a stream of partitions of q having n parts,
+    in memory bounded by block, bins and k however long the stream is. The
+    stream may yield single partitions, e.g. from iter_partitions(), which are
+    gathered block rows at a time into one array, or 2-D arrays of partitions,
+    e.g. from iter_rand_partitions(). The metrics of each block or array are
+    added to a Welford accumulator, a Histogram and a QuantileSketch per metric.
+    
+    Arguments:
+        partitions : an iterable of partitions, or of arrays of partitions
+        q : Total sum across parts
+        n : Number of parts to sum over
+        bins : the number of bins of each histogram, spanning metric_bounds()
+        block : the number of single partitions whose metrics are found together
+        k : the size of each QuantileSketch
+        rng : the source of random numbers of the sketches, as for
+            rand_partitions()
+    
+    Returns: a dictionary of {'moments': Welford, 'histogram': Histogram,
+        'quantiles': QuantileSketch} for each of 'gini', 'evar', 'variance',
+        'skewness' and 'median'. Those of separate streams, e.g. of parallel
+        workers, are combined by merge_distributions().
+    
+    """
+    
+    results = {}
+    for name, (lo, hi) in metric_bounds(q, n).items():
+        results[name] = {'moments': Welford(), 'histogram': Histogram(lo, hi, bins),
+                         'quantiles': QuantileSketch(k, rng)}
+    
+    def flush(rows):
+        for name, values in compute_all(rows).items():
+            for accumulator in results[name].values():
+                accumulator.add_many(values)
+    
+    buf = np.zeros((block, n), dtype=np.int64)
+    i = 0
+    for partition in partitions:
+        if np.ndim(partition) == 2:
+            flush(np.asarray(partition))
+            continue
+        buf[i] = partition
+        i += 1
+        if i == block:
+            flush(buf)
+            i = 0
+    if i:
+        flush(buf[:i])
+    return results
+
+
+def merge_distributions(results, other):
+    """ Add the accumulators of other to those of results, both as returned by
+    stream_distributions() for the same q, n and bins. Returns results. """
+    for name in results:
+        for key, accumulator in results[name].items():
+            accumulator.merge(other[name][key])
+    return results
+
+
+def feasible_set_distributions(q, n, bins=100, block=4096, k=200, rng=None):
+    """
+    Find the exact distribution of each metric across every partition of q
+    having n parts, without listing them. The partitions are generated in place
+    by pypartitions' iter_partitions() and streamed through
+    stream_distributions(), whose arguments and return value these are. Only
+    the quantile sketches are approximate.
+    
+    """
+    return stream_distributions(parts.iter_partitions(q, n, reuse=True), q, n,
+                                bins, block, k, rng)
+
+
+def sample_distributions(q, n, sample_size, bins=100, k=200, rng=None,
+                         method='best', D=None, chunk_size=10000):
+    """
+    Find the distribution of each metric across sample_size random partitions
+    of q having n parts, generated chunk_size at a time by pypartitions'
+    iter_rand_partitions() and streamed through stream_distributions(), so
+    memory is bounded however large the sample. The arguments are as for those
+    functions, and the return value as for stream_distributions().
+    
+    """
+    chunks = parts.iter_rand_partitions(q, n, sample_size, method, D, rng=rng,
+                                        chunk_size=chunk_size)
+    return stream_distributions(chunks, q, n, bins, k=k, rng=rng)
+
+
+
+""" functions for scoring observed vectors against their feasible sets """
+
+def load_observations(path):
+    """ Read observed vectors from a .npy file (a 2-D array, one vector per row)
+    or a CSV file (one vector per line, of any length). Zeros and empty fields
+    are dropped, so each vector holds its positive values only, and so are rows
+    left with no values, e.g. blank lines or rows of zeros. """
+    if path.endswith('.npy'):
+        rows = np.load(path).tolist()
+    else:
+        rows = []
+        with open(path) as f:
+            for line in csv.reader(f):
+                rows.append([int(float(x)) for x in line if x.strip() != ''])
+    vectors = [[int(x) for x in row if x > 0] for row in rows]
+    return [vector for vector in vectors if len(vector) > 0]
+
+
+def _percentiles(reference, values):
+    """ The percentile of each value among the reference values, counting ties
+    as half below, i.e. stats.percentileofscore(reference, value, kind='mean').
+    NaN reference values are left out, and NaN values score NaN. """
+    reference = np.sort(reference[~np.isnan(reference)])
+    values = np.asarray(values, dtype=float)
+    left = np.searchsorted(reference, values, side='left')
+    right = np.searchsorted(reference, values, side='right')
+    pct = (left + right) / 2 / max(len(reference), 1) * 100
+    pct[np.isnan(values)] = np.nan
+    return pct
+
+
+def feasible_set_metrics(q, n, block=4096):
+    """ The metrics, as returned by compute_all(), of every partition of q
+    having n parts. The partitions are generated in place by iter_partitions()
+    into a buffer of block rows, as by stream_distributions(), so only the
+    metrics of the whole feasible set are held, not its partitions. """
+    chunks = {}
+    
+    def flush(rows):
+        for name, values in compute_all(rows).items():
+            chunks.setdefault(name, []).append(values)
+    
+    buf = np.zeros((block, n), dtype=np.int64)
+    i = 0
+    for partition in parts.iter_partitions(q, n, reuse=True):
+        buf[i] = partition
+        i += 1
+        if i == block:
+            flush(buf)
+            i = 0
+    if i:
+        flush(buf[:i])
+    return dict((name, np.concatenate(values)) for name, values in chunks.items())
+
+
+def score_observations(observed, sample_size=10000, exact_max=100000, rng=None):
+    """
+    Find the percentile of each metric (Gini's coefficient, Evar, variance,
+    skewness and the median) of each observed vector among the partitions of
+    its feasible set, i.e. of its total q into its number of values n.
+    
+    Vectors are grouped by (q, n), and each group is scored against one
+    reference set: every partition, if the feasible set has no more than
+    exact_max members, or else sample_size random partitions. The random
+    partitions of all the groups are drawn by iter_rand_partitions_many(), from
+    one shared count table, and each sample is reduced to its metrics before the
+    next is drawn.
+    
+    Arguments:
+        observed : a list of vectors of positive integers, or the path of a file
+            for load_observations()
+        sample_size : the number of random partitions for a large feasible set
+        exact_max : the largest feasible set to enumerate in full
+        rng : the source of random numbers, as for rand_partitions()
+    
+    Returns: a list with a dictionary for each observed vector, in order, of
+        its 'q', 'n', 'exact' (True if scored against the whole feasible set)
+        and the percentile of each metric
+    
+    """
+    if isinstance(observed, str):
+        observed = load_observations(observed)
+    
+    groups = {}
+    for i, vector in enumerate(observed):
+        if len(vector) == 0:
+            raise ValueError('observed vector ' + str(i) + ' is empty')
+        key = (int(sum(vector)), len(vector))
+        groups.setdefault(key, []).append(i)
+    
+    D = parts.CountTable()
+    exact = set()
+    sampled = []
+    for q, n in groups:
+        if D.count(q - n, min(n, q - n)) <= exact_max:
+            exact.add((q, n))
+        else:
+            sampled.append((q, n))
+    references = {}
+    for key, sample in parts.iter_rand_partitions_many(sampled, sample_size, D=D,
+                                                        rng=rng, as_array=True):
+        references[key] = compute_all(sample) # before the next sample is drawn
+    for q, n in exact:
+        references[(q, n)] = feasible_set_metrics(q, n)
+    
+    scores = [None] * len(observed)
+    for (q, n), members in groups.items():
+        reference = references[(q, n)]
+        values = compute_all(np.array([observed[i] for i in members]))
+        percentiles = {}
+        for name in reference:
+            percentiles[name] = _percentiles(reference[name], values[name])
+        for row, i in enumerate(members):
+            score = {'q': q, 'n': n, 'exact': (q, n) in exact}
+            for name in percentiles:
+                score[name] = float(percentiles[name][row])
+            scores[i] = score
+    return scores
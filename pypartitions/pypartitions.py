@@ -1,5 +1,9 @@
 from __future__ import division
 import sys
+import os
+import mmap
+import struct
+import tempfile
 import numpy as np
 from scipy import stats
 import random, decimal
@@ -7,12 +11,20 @@ from random import choice
 import re
 import math
 import itertools
+import bisect
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 """ Functions for generating random integer partitions of a total q having 
     exactly n parts. """
 
 
+CONJUGATE_NUMPY_MIN = 200 # conjugate() uses numpy when the partition and its conjugate
+# have at least this many parts together
+
+
 def conjugate(partition):
     """
     Find the conjugate of an integer partition. Recoded (on 24-Apr-2013) from
@@ -20,6 +32,8 @@ def conjugate(partition):
     
     if partition == []:
         return []
+    elif len(partition) + partition[0] >= CONJUGATE_NUMPY_MIN:
+        return conjugate_counts(partition)[1:].tolist()
     else:
         l = len(partition)
         conj =  [l] * partition[-1]
@@ -28,6 +42,78 @@ def conjugate(partition):
         return conj
 
 
+def conjugate_counts(partition):
+    """ Return an array c with c[j] the number of parts of at least j in a
+    partition, for 0 <= j <= its largest part, i.e. c[1:] is its conjugate """
+    
+    return np.cumsum(np.bincount(partition)[::-1])[::-1]
+
+
+def conjugate_into(partition, row):
+    """ Write the conjugate of a partition into row, an array of zeros at least
+    as long as the largest part, without making a list of the conjugate """
+    
+    if partition == []:
+        return
+    if len(partition) + partition[0] >= CONJUGATE_NUMPY_MIN:
+        row[:partition[0]] = conjugate_counts(partition)[1:]
+        return
+    l = len(partition)
+    start = 0
+    for i in range(l, 0, -1):
+        if i == l:
+            width = partition[-1]
+        else:
+            width = partition[i - 1] - partition[i]
+        row[start:start + width] = i
+        start += width
+
+
+""" A partition can also be held in run-length form, as a list of (value, count)
+    pairs with decreasing values, e.g. [(7, 1), (3, 2), (1, 400000)] for 7, 3, 3
+    and 400000 ones. The form takes memory in proportion to the number of distinct
+    parts, which is less than sqrt(2q) for a total q. """
+
+
+def to_runs(partition):
+    """ Return the run-length form of a partition with its parts in decreasing
+    order """
+    
+    runs = []
+    for value, group in itertools.groupby(partition):
+        runs.append((value, len(list(group))))
+    return runs
+
+
+def from_runs(runs):
+    """ Return the partition (a list of parts) having the run-length form runs """
+    
+    partition = []
+    for value, count in runs:
+        partition.extend([value] * count)
+    return partition
+
+
+def conjugate_runs(runs):
+    """ Find the conjugate of an integer partition in run-length form, in the
+    same form. The parts of the conjugate are the number of parts of at least
+    each value, so a run (v, c) followed by a run of smaller value w (or 0)
+    gives v - w parts equal to the number of parts of at least v. """
+    
+    conj = []
+    parts = 0
+    for i, (value, count) in enumerate(runs):
+        parts += count
+        if i + 1 < len(runs):
+            width = value - runs[i + 1][0]
+        else:
+            width = value
+        if width > 0:
+            conj.append((parts, width))
+    conj.reverse()
+    return conj
+
+
 def NrParts(*args):
     """ Find the number of partition for a given total q and number of parts n. Recoded
         (on 24-Apr-2013) and modified from GAP source code: www.gap-system.org
@@ -61,7 +147,11 @@ def NrParts(*args):
             args = [q-n]
     
     numparts = 0  
-    if len(args) == 1: # if we're finding p(q)
+    if len(args) == 1 and args[0] >= HRR_MIN_Q: # p(q) for large q
+        
+        numparts = rademacher(args[0])
+        
+    elif len(args) == 1: # if we're finding p(q)
         
         q = args[0]
         
@@ -71,13 +161,15 @@ def NrParts(*args):
             numparts = 0
             k = 1
             l = 1                         
+            sign = 1 # -(-1)**k
             while 0 <= i-(l+k):
-                numparts = numparts - (-1)**k * (p[i-l] + p[i-(l+k)])
+                numparts = numparts + sign * (p[i-l] + p[i-(l+k)])
                 k = k + 1
                 l = l + 3*k - 2
+                sign = -sign
             
             if 0 <= i-l:
-                numparts = numparts - (-1)**k * p[i-l]
+                numparts = numparts + sign * p[i-l]
             p[i] = numparts
     
     elif len(args) == 2: # if we're finding p(q, n)   
@@ -92,17 +184,199 @@ def NrParts(*args):
         else:
             q1 = int(q)
             k1 = int(n)
-            p = [1]*q1
-        
-            for i in range(2,k1+1):  
-                for m  in range(i+1,q1-i+1+1):
-                    p[m] = p[m] + p[m-i]
+            hi = q1 - k1 + 1 # p[m] for m > hi never reaches p[hi], so is not kept
+            dtype = np.int64 if fits_int64(hi) else object
+            p = np.ones(2 * hi + 2, dtype=dtype) # room to pad the last block
+            
+            for i in range(2, min(k1, hi - 1) + 1):
+                # p[m] = p[m] + p[m-i] for m = i+1 ... hi. Each block of i values
+                # depends only on the block before it, so the blocks are stacked
+                # as the rows of a matrix and summed down its columns, in place.
+                blocks = -(-hi // i)
+                view = p[1:1 + blocks * i].reshape(blocks, i)
+                np.add.accumulate(view, axis=0, out=view)
             
-            numparts = p[q1-k1+1]
+            numparts = int(p[hi])
     
     return numparts
 
+
+def fits_int64(q):
+    """ True if p(m), the number of partitions of m, fits in an int64 for all
+    m <= q, using the bound p(m) < exp(pi sqrt(2m/3)) """
+    
+    return math.pi * math.sqrt(2.0 * q / 3.0) < 63 * math.log(2)
+
+    
+
+""" Functions for finding p(q) exactly from the Hardy-Ramanujan-Rademacher series
+
+        p(q) = 1/(pi sqrt(2)) sum_{k >= 1} A_k(q) sqrt(k) d/dq [sinh(C L / k) / L]
+
+    where L = sqrt(q - 1/24), C = pi sqrt(2/3) and A_k(q) is a Kloosterman-type sum.
+    The series is truncated after the number of terms at which the Rademacher-Lehmer
+    bound on the remainder is below 1/4, and each term is computed with just enough
+    bits that the sum is within 1/2 of p(q), which is then rounded to an integer.
+    The k-th term is of size exp(C L / k), so the first terms need as many bits as
+    p(q) itself while most later terms fit in a float. High precision terms use
+    fixed-point arithmetic on Python integers, i.e. a value x is held as the integer
+    x * 2**bits.
+    
+    Rademacher, H. (1938). On the partition function p(n). Proceedings of the London
+      Mathematical Society 43: 241-254.
+    Johansson, F. (2012). Efficient implementation of the Hardy-Ramanujan-Rademacher
+      formula. LMS Journal of Computation and Mathematics 15: 341-359. """
+
+HRR_MIN_Q = 1000 # below this, NrParts(q) uses the pentagonal number recurrence
+
+
+def _pi_fixed(bits):
+    """ pi * 2**bits, from the Chudnovsky series """
+    
+    prec = bits + 20
+    one = 1 << prec
+    K, M, L, X = 6, 1, 13591409, 1
+    S = L * one
+    for i in range(1, prec // 47 + 2): # each term adds more than 47 bits
+        M = M * (K ** 3 - 16 * K) // i ** 3
+        L += 545140134
+        X *= -262537412640768000
+        S += M * L * one // X
+        K += 12
+    pi = 426880 * math.isqrt(10005 << (2 * prec)) * one // S
+    return pi >> 20
+
+
+def _exp_fixed(x, bits):
+    """ exp(x / 2**bits) * 2**bits for x >= 0. The argument is halved r times,
+    the Taylor series is summed and the result is squared r times. """
+    
+    r = max(x.bit_length() - bits, 0) + int(math.sqrt(bits)) + 1
+    w = bits + r + 10 # working bits, guarding against the error of squaring
+    one = 1 << w
+    y = (x << (w - bits)) >> r
+    s = one
+    t = one
+    j = 1
+    while t:
+        t = t * y // (j << w)
+        s += t
+        j += 1
+    for i in range(r):
+        s = s * s >> w
+    return s >> (w - bits)
+
+
+def _cos_fixed(x, pi, bits):
+    """ cos(x / 2**bits) * 2**bits for 0 <= x <= 2 pi, where pi is pi * 2**bits.
+    The argument is halved r times, the Taylor series is summed and the result
+    is doubled r times with cos(2y) = 2 cos(y)**2 - 1. """
+    
+    sign = 1
+    if x > pi:
+        x = 2 * pi - x
+    if 2 * x > pi:
+        x = pi - x
+        sign = -1
+    r = int(math.sqrt(bits) / 2) + 1
+    w = bits + 2 * r + 10 # each doubling can multiply the error by 4
+    one = 1 << w
+    y = (x << (w - bits)) >> r
+    y2 = y * y >> w
+    s = one
+    t = one
+    j = 0
+    while t:
+        j += 2
+        t = -(t * y2 // ((j * (j - 1)) << w))
+        s += t
+    for i in range(r):
+        s = (2 * s * s >> w) - one
+    return sign * (s >> (w - bits))
+
+
+def _selberg_terms(q, k):
+    """ The values of l, 0 <= l < 2k, with (3l^2 + l)/2 = -q (mod k). By Selberg's
+    formula A_k(q) = sqrt(k/3) sum (-1)^l cos(pi (6l + 1) / 6k) over these l. """
+    
+    l = np.arange(2 * k, dtype=np.int64)
+    return [int(x) for x in np.nonzero(((3 * l * l + l) // 2 + q % k) % k == 0)[0]]
+
+
+def _rademacher_remainder(q, N):
+    """ Rademacher and Lehmer's bound on the remainder of the series after N terms """
+    
+    try:
+        s = math.sinh(math.pi * math.sqrt(2.0 * q / 3.0) / N)
+    except OverflowError:
+        return float('inf')
+    return (44 * math.pi ** 2 / (225 * math.sqrt(3)) / math.sqrt(N)
+            + math.pi * math.sqrt(2) / 75 * math.sqrt(N / (q - 1.0)) * s)
+
+
+def rademacher(q):
+    """ Find p(q), the number of partitions of q, from the Hardy-Ramanujan-Rademacher
+    series. Exact for q > 1; used by NrParts(q) when q >= HRR_MIN_Q. """
+    
+    lo, hi = 1, 2 # find the number of terms, N
+    while _rademacher_remainder(q, hi) >= 0.25:
+        hi *= 2
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _rademacher_remainder(q, mid) < 0.25:
+            hi = mid
+        else:
+            lo = mid + 1
+    N = lo
     
+    L = math.sqrt(q - 1.0 / 24)
+    C = math.pi * math.sqrt(2.0 / 3.0)
+    guard = 30 + N.bit_length() # bits kept below the binary point of each term
+    top = int(C * L / math.log(2)) + guard
+    pi_top = _pi_fixed(top)
+    
+    small = 0.0 # the sum of the terms small enough for floating point
+    total = 0 # the sum of the other terms, times 2**guard
+    for k in range(1, N + 1):
+        ls = _selberg_terms(q, k)
+        if not ls:
+            continue
+        x = C * L / k
+        
+        if x < 10:
+            A = 0.0
+            for l in ls:
+                A += (-1) ** l * math.cos(math.pi * (6 * l + 1) / (6.0 * k))
+            A *= math.sqrt(k / 3.0)
+            small += (A * math.sqrt(k) / (2 * L) *
+                      (C / k * math.cosh(x) / L - math.sinh(x) / L ** 2))
+            continue
+        
+        bits = int(x / math.log(2)) + guard
+        one = 1 << bits
+        pi = pi_top >> (top - bits)
+        Lf = math.isqrt(((24 * q - 1) << (2 * bits)) // 24)
+        Cf = pi * math.isqrt((2 << (2 * bits)) // 3) >> bits
+        e = _exp_fixed((Cf * Lf >> bits) // k, bits)
+        ei = (one << bits) // e
+        sinh = (e - ei) >> 1
+        cosh = (e + ei) >> 1
+        
+        A = 0
+        for l in ls:
+            c = _cos_fixed(pi * (6 * l + 1) // (6 * k), pi, bits)
+            A += c if l % 2 == 0 else -c
+        A = A * math.isqrt((k << (2 * bits)) // 3) >> bits
+        
+        d = Cf * cosh // (Lf * k) - (sinh << bits) // (Lf * Lf >> bits)
+        term = ((A * math.isqrt(k << (2 * bits)) >> bits) << bits) // (2 * Lf)
+        total += (term * d >> bits) >> (bits - guard)
+    
+    total += int(small * (1 << guard))
+    pi_sqrt2 = pi_top * math.isqrt(2 << (2 * top)) >> top
+    numparts = (total << top) // pi_sqrt2
+    return (numparts + (1 << (guard - 1))) >> guard
+
 
 def P(D, q, k):
     """ A function to return the number of partitions of q with k or less parts.
@@ -127,15 +401,21 @@ def P(D, q, k):
                number_of_partitions(99+2, 2) = 50 = Partitions(99, max_part=2).cardinality() 
            
     Arguments:
-        D : a dictionary for the number of partitions of q having k or less
-            parts (or k or less as the largest part), i.e. P(q, q + k).   
+        D : a CountTable or a dictionary for the number of partitions of q
+            having k or less parts (or k or less as the largest part), i.e. P(q, q + k).   
         q : the total (i.e. sum across all k or n parts)
         k : the number of parts and also the size of the largest part (congruency)     
     
     Because of the congruency above (Bona 2006) k and n are sometimes used synomously.
     
+    D can also be a CountTable, in which case the value is read from (and if
+    needed, lazily computed into) the table rather than from NrParts.
+    
     """
     
+    if type(D) is CountTable:
+        return [D, D.count(q, k)]
+    
     if (q, k) not in D:
         D[(q, k)] = NrParts(q + k, k)
         # Note from the above: p(q) = p(q + q, q)
@@ -143,7 +423,659 @@ def P(D, q, k):
     return [D, D[(q, k)]] # return the updated dictionary and P(q + k, k).
 
 
-def rand_partitions(q, n, sample_size, method='best', D={}, zeros=False):
+class CountTable(object):
+    """ A table of the number of partitions of m having k or less parts (or k or
+    less as the largest part), i.e. the values returned by P(D, m, k).
+    
+    The table is built by a single dynamic programming sweep using the recurrence
+    
+        P(m, k) = P(m, k - 1) + P(m - k, k)
+    
+    i.e. the partitions of m with k or less as the largest part are those with k-1
+    or less as the largest part plus those having at least one part equal to k.
+    Row k holds P(m, k) for m = 0, 1, 2, ... and is computed from row k - 1, so
+    each cell is computed once, in O(1), instead of calling NrParts(m + k, k) for
+    every cell.
+    
+    Rows are filled lazily: a request for P(m, k) extends rows 0 through k to
+    hold cells 0 through m, and nothing more. Because P(m, k) = P(m, m) when
+    k > m, no row longer than needed is ever built.
+    
+    A CountTable can be passed to P(), rand_partitions() and the sampling
+    functions in place of the dictionary D. Every cell is considered to be in
+    the table, i.e. (m, k) in table is always True.
+    
+    Rows are held as numpy uint64 arrays, and built with numpy, for as long as
+    their counts fit in 64 bits (e.g. every count of q < 400). A row with a count
+    that does not fit is promoted to a list of python integers, and so are the
+    rows above it, since P(m, k) >= P(m, k - 1). Counts are always returned as
+    python integers.
+    
+    The table can be bounded, e.g. when one table is kept for the life of a
+    long-running process. When it holds more than max_cells cells, whole rows
+    are evicted, least useful first: the rows read the fewest times, weighted
+    by the number of rows that would have to be rebuilt to read them again (see
+    evict()). An evicted row that is needed again is rebuilt from the nearest
+    row below it that holds the cells needed. Row 0 and the row being read are
+    never evicted.
+    
+    Arguments:
+        rows : a list of rows; rows[k][m] = P(m, k), or None if row k was evicted.
+            A row is a numpy uint64 array or a list of python integers.
+        max_cells : the largest number of cells to hold, or None for no bound
+        hits : the number of reads answered from cells already in the table
+        misses : the number of reads that had to compute cells
+        evictions : the number of rows evicted
+        peak_cells : the most cells held while a bounded table was being filled
+        row_hits : a dictionary of the number of reads of each row (kept only
+            for a bounded table)
+        dense : the int64 array kept by dense_table(), or None. Its cells are
+            counted against max_cells, and it is dropped before any row is
+            evicted
+    
+    """
+    
+    def __init__(self, max_cells=None):
+        self.rows = [np.ones(1, dtype=np.uint64)] # P(0, 0) = 1 by convention
+        self.max_cells = max_cells
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.peak_cells = 0
+        self.row_hits = {}
+        self.dense = None
+    
+    def __contains__(self, key):
+        return True
+    
+    def __getitem__(self, key):
+        q, k = key
+        return self.count(q, k)
+    
+    def __len__(self):
+        """ the number of cells held, in the rows and the dense table """
+        return self.row_cells() + self.dense_cells()
+    
+    def row_cells(self):
+        return sum(len(row) for row in self.rows if row is not None)
+    
+    def dense_cells(self):
+        dense = self.dense
+        if dense is None:
+            return 0
+        k, q = dense.shape[0] - 1, dense.shape[1] - 1
+        return (k + 1) * (q + k + 1) # dense_counts() allocates q + k + 1 columns
+    
+    def stats(self):
+        """ Return a dictionary describing the size and use of the table """
+        return {'rows': sum(1 for row in self.rows if row is not None),
+                'cells': len(self),
+                'dense_cells': self.dense_cells(),
+                'max_cells': self.max_cells,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'peak_cells': max(self.peak_cells, len(self))}
+    
+    def dense_table(self, q, k):
+        """ Return dense_counts(q, k), from the table kept by an earlier call if
+        that covers q and k. Otherwise a table covering both is built and kept
+        for later calls, if it has no more than VECTORIZED_MAX_CELLS cells and,
+        in a bounded table, fits within max_cells with the rows; if not, a table
+        for q and k alone is built and returned without being kept. The caller
+        must check that P(q, k) fits in an int64; cells of a larger kept table
+        that do not fit are wrong, but are never read. """
+        
+        dense = self.dense
+        if dense is not None and dense.shape[0] > k and dense.shape[1] > q:
+            return dense
+        kq, kk = q, k
+        if dense is not None:
+            kq = max(q, dense.shape[1] - 1)
+            kk = max(k, dense.shape[0] - 1)
+        cells = (kk + 1) * (kq + kk + 1)
+        if cells > VECTORIZED_MAX_CELLS or (self.max_cells is not None and
+                                            self.row_cells() + cells > self.max_cells):
+            return dense_counts(q, k)
+        dense = self.dense = dense_counts(kq, kk)
+        return dense
+    
+    def count(self, q, k):
+        """ Return the number of partitions of q having k or less parts """
+        
+        if q < 0 or k < 0:
+            return 0
+        if k > q:
+            k = q
+        
+        rows = self.rows
+        if k < len(rows) and rows[k] is not None and q < len(rows[k]):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.fill(q, k)
+            if self.max_cells is not None:
+                self.evict(k)
+        
+        if self.max_cells is not None:
+            self.row_hits[k] = self.row_hits.get(k, 0) + 1
+        
+        row = rows[k]
+        if type(row) is np.ndarray:
+            return row.item(q) # a python integer
+        return row[q]
+    
+    def fill(self, q, k):
+        """ Extend row k of the table to hold cells 0 through q, with the rows
+        below it that this depends on. Row i is extended from row i - 1, so only
+        the rows above the highest row below k that already holds cell q are
+        built: any evicted rows further down are left evicted. In a bounded
+        table, a row built by the sweep that was not held before is freed as
+        soon as the row above it is built, whenever the table is over max_cells,
+        so a single miss never holds much more than max_cells cells. """
+        
+        rows = self.rows
+        held = len(rows)
+        while len(rows) <= k:
+            rows.append(np.ones(1, dtype=np.uint64)) # P(0, k) = 1
+        
+        low = k
+        while low > 0 and (rows[low] is None or len(rows[low]) <= q):
+            low -= 1
+        
+        built = set() # rows not held before this sweep
+        for i in range(low, k + 1):
+            row = rows[i]
+            if row is None or i >= held:
+                built.add(i)
+            if row is None:
+                rows[i] = np.ones(1, dtype=np.uint64) # an evicted row, to be rebuilt
+            elif len(row) > q or isinstance(row, list):
+                continue
+            elif isinstance(row, np.ndarray):
+                rows[i] = row.astype(np.uint64) # a writable copy of e.g. a mapped row
+            else:
+                rows[i] = list(row) # a row of big counts loaded from a file
+        
+        row = rows[0]
+        if low == 0 and len(row) <= q: # P(m, 0) = 0 for m > 0
+            rows[0] = np.concatenate([row, np.zeros(q + 1 - len(row), dtype=np.uint64)])
+        
+        bounded = self.max_cells is not None
+        if bounded:
+            cells = len(self)
+        for i in range(max(low, 1), k + 1):
+            prev = rows[i - 1]
+            row = rows[i]
+            start = len(row)
+            if start > q:
+                continue
+            if isinstance(row, np.ndarray):
+                new = _extend_row(prev, row, i, q)
+                if new is None:
+                    row = rows[i] = row.tolist() # promote to python integers
+                else:
+                    rows[i] = np.concatenate([row, new])
+            
+            if isinstance(row, list):
+                if isinstance(prev, np.ndarray):
+                    prev = prev.tolist()
+                for m in range(start, q + 1):
+                    if m >= i:
+                        row.append(prev[m] + row[m - i])
+                    else:
+                        row.append(prev[m]) # no part of m can equal i
+            
+            if bounded:
+                cells += len(rows[i]) - start
+                self.peak_cells = max(self.peak_cells, cells)
+                if cells > self.max_cells and i > 1 and i - 1 in built:
+                    cells -= len(rows[i - 1]) # row i - 1 was needed only for row i
+                    rows[i - 1] = None
+        return
+    
+    def evict(self, keep):
+        """ Evict the least useful rows, other than row 0 and row keep, until
+        the table holds no more than max_cells cells. A row's use is the number
+        of times it was read times the number of rows a read would rebuild if it
+        were evicted: itself and the run of evicted rows directly below it, down
+        to a row that is still held. Ties go to the longest row. """
+        
+        rows = self.rows
+        cells = len(self)
+        if cells > self.max_cells and self.dense is not None:
+            cells -= self.dense_cells() # cheaper to rebuild than any row
+            self.dense = None
+        row_hits = self.row_hits
+        while cells > self.max_cells:
+            best = None
+            run = 0 # the number of evicted rows directly below row i
+            for i in range(1, len(rows)):
+                row = rows[i]
+                if row is None:
+                    run += 1
+                    continue
+                if i != keep:
+                    key = (row_hits.get(i, 0) * (run + 1), -len(row), i)
+                    if best is None or key < best:
+                        best = key
+                run = 0
+            if best is None:
+                break
+            i = best[2]
+            cells -= len(rows[i])
+            rows[i] = None
+            self.evictions += 1
+        return
+
+
+def _extend_row(prev, row, i, q):
+    """ Return cells len(row) through q of row i of a CountTable as a uint64 array,
+    given the rows i - 1 (prev) and i as uint64 arrays, or None if a cell does not
+    fit in 64 bits.
+    
+    P(m, i) = P(m, i - 1) + P(m - i, i), so each block of i new cells depends only
+    on the block before it: the blocks are stacked as the rows of a matrix and
+    summed down its columns. The sums never decrease down a column, so a sum that
+    wrapped around 2**64 shows up as a cell smaller than the one above it. """
+    
+    if not isinstance(prev, np.ndarray):
+        return None
+    start = len(row)
+    new = prev[start:q + 1].copy()
+    lo, hi = max(start, i), min(start + i, q + 1) # cells that add a cell of row
+    if lo < hi:
+        first = new[lo - start:hi - start]
+        total = first + row[lo - i:hi - i]
+        if (total < first).any():
+            return None
+        new[lo - start:hi - start] = total
+    
+    n = len(new)
+    blocks = -(-n // i)
+    new = np.concatenate([new, np.zeros(blocks * i - n, dtype=np.uint64)])
+    sums = new.reshape(blocks, i).cumsum(axis=0)
+    if (sums[1:] < sums[:-1]).any():
+        return None
+    return sums.ravel()[:n]
+
+
+""" Functions for storing count tables on disk, so that the tables can be shared
+    across runs and processes rather than being recomputed.
+
+    File format (all integers little-endian):
+        header : the magic bytes b'PPCT', the format version (uint32) and the
+                 number of rows (uint64)
+        index  : for each row, the byte offset of the row, the number of cells
+                 in the row and the number of bytes per cell (3 x uint64)
+        data   : for each row, its cells as unsigned integers of fixed width
+
+    Each row uses the fewest bytes per cell that hold its largest value, so rows
+    of small counts stay small while rows of big counts keep full precision. Rows
+    of 1, 2, 4 or 8 bytes per cell are mapped directly as numpy arrays. """
+
+_MAGIC = b'PPCT'
+_VERSION = 1
+_HEADER = struct.Struct('<4sIQ')
+_ROW_INDEX = struct.Struct('<QQQ')
+
+
+class _MappedRow(object):
+    """ A read-only row of a count table held in a memory-mapped file. Cells are
+    decoded when they are read. """
+
+    def __init__(self, buf, offset, length, width):
+        self.buf = buf
+        self.offset = offset
+        self.length = length
+        self.width = width
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, m):
+        if m < 0:
+            m += self.length
+        if m < 0 or m >= self.length:
+            raise IndexError('count table row index out of range')
+        start = self.offset + m * self.width
+        return int.from_bytes(self.buf[start:start + self.width], 'little')
+
+    def __iter__(self):
+        for m in range(self.length):
+            yield self[m]
+
+
+def save_count_table(table, path):
+    """ Write a CountTable to path. The table is written to a temporary file in
+    the same directory and then renamed over path, so readers (including other
+    processes) only ever see a complete file. """
+
+    rows = [row if row is not None else [] for row in table.rows]
+    widths = []
+    for row in rows:
+        if isinstance(row, np.ndarray):
+            width = int(row.max()).bit_length() if len(row) else 0
+        else:
+            width = max(int(v).bit_length() for v in row) if len(row) else 0
+        width = max(1, (width + 7) // 8)
+        for w in (1, 2, 4, 8):
+            if width <= w:
+                width = w
+                break
+        widths.append(width)
+
+    offset = _HEADER.size + _ROW_INDEX.size * len(rows)
+    index = []
+    for row, width in zip(rows, widths):
+        index.append(_ROW_INDEX.pack(offset, len(row), width))
+        offset += len(row) * width
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp_counts_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(rows)))
+            f.write(b''.join(index))
+            for row, width in zip(rows, widths):
+                if width <= 8:
+                    f.write(np.asarray(row, dtype=np.uint64).astype('<u' + str(width)).tobytes())
+                else:
+                    f.write(b''.join(int(v).to_bytes(width, 'little') for v in row))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return
+
+
+def load_count_table(path):
+    """ Return a CountTable backed by the file at path, which was written by
+    save_count_table(). The file is memory-mapped and cells are decoded only when
+    the samplers read them. Rows are copied into memory if the table has to be
+    extended beyond what the file holds. """
+
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buf) < _HEADER.size:
+        raise ValueError(path + ' is not a count table file')
+    magic, version, nrows = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(path + ' is not a count table file')
+
+    rows = []
+    for i in range(nrows):
+        offset, length, width = _ROW_INDEX.unpack_from(buf, _HEADER.size + i * _ROW_INDEX.size)
+        if offset + length * width > len(buf):
+            raise ValueError(path + ' is truncated')
+        if width in (1, 2, 4, 8):
+            rows.append(np.frombuffer(buf, dtype='<u' + str(width), count=length, offset=offset))
+        else:
+            rows.append(_MappedRow(buf, offset, length, width))
+
+    table = CountTable()
+    if rows:
+        table.rows = rows
+    return table
+
+
+def cached_count_table(q, n, zeros, cache_dir):
+    """ Return the CountTable needed to sample partitions of q having n parts,
+    loading it from cache_dir if an earlier run (or another process) stored it
+    there, and otherwise building it and storing it in cache_dir.
+
+    Arguments:
+        q : Total sum across parts
+        n : Number of parts to sum over
+        zeros : boolean if True partitions can have zero values
+        cache_dir : the directory holding the count table files
+
+    """
+
+    path = os.path.join(cache_dir, 'counts_q=' + str(q) + '_n=' + str(n) +
+                        '_zeros=' + str(int(bool(zeros))) + '.bin')
+    if os.path.exists(path):
+        return load_count_table(path)
+
+    if zeros:
+        q1, k = q, min(q, n)
+    else:
+        q1, k = q - n, min(q - n, n)
+
+    table = CountTable()
+    table.fill(q1, k)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_count_table(table, path)
+    return table
+
+
+def randrange(rng, start, stop):
+    """ Return a random integer from start to stop - 1, drawn with rng: None for
+    the random module, a random.Random or a numpy.random.Generator. A Generator
+    draws integers larger than an int64 from random bytes, by rejection. """
+    
+    if rng is None:
+        return random.randrange(start, stop)
+    if isinstance(rng, np.random.Generator):
+        if stop <= 2 ** 63:
+            return int(rng.integers(start, stop))
+        span = stop - start
+        bits = span.bit_length()
+        nbytes = (bits + 7) // 8
+        while True:
+            r = int.from_bytes(rng.bytes(nbytes), 'little') >> (8 * nbytes - bits)
+            if r < span:
+                return start + r
+    return rng.randrange(start, stop)
+
+
+def rand_ranks(rng, numparts, size):
+    """ Return a list of size random integers from 1 to numparts, drawn with
+    rng as in randrange(). A Generator draws them in one call if numparts fits
+    in an int64. """
+    
+    if isinstance(rng, np.random.Generator) and numparts < 2 ** 63:
+        return rng.integers(1, numparts + 1, size=size, dtype=np.int64).tolist()
+    return [randrange(rng, 1, numparts + 1) for i in range(size)]
+
+
+def part_dtype(q):
+    """ Return the smallest signed integer dtype that holds q """
+    
+    for dtype in (np.int8, np.int16, np.int32):
+        if q <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+""" Functions for choosing the fastest sampler for q, n and zeros on the machine at
+    hand. calibrate() times the samplers over a grid of (q, n, zeros) and saves the
+    times, in seconds per partition, as a JSON file:
+    
+        {"version": 1, "points": [{"q": 100, "n": 10, "zeros": false,
+                                   "costs": {"bottom_up": 1.2e-05, ...}}, ...]}
+    
+    For other q and n, the costs are predicted from the nearest point of the grid
+    with the same value of zeros, in (log q, n/q), scaled in proportion to q. """
+
+SAMPLERS = ['bottom_up', 'top_down', 'divide_and_conquer', 'multiplicity']
+CALIBRATION_GRID = [(q, max(1, int(f * q)), zeros) for q in (100, 300, 1000, 3000)
+                    for f in (0.02, 0.1, 0.25, 0.5) for zeros in (False, True)]
+_calibration = {} # the calibration in use, by path, loaded by load_calibration()
+
+
+def calibration_path():
+    """ The file calibrate() saves to by default: $PYPARTITIONS_CALIBRATION, or
+    else ~/.pypartitions/calibration.json """
+    
+    path = os.environ.get('PYPARTITIONS_CALIBRATION')
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), '.pypartitions', 'calibration.json')
+
+
+def calibrate(grid=None, draws=50, time_limit=0.5, path=None, save=True, rng=None):
+    """
+    Time each of the samplers in SAMPLERS at each (q, n, zeros) of a grid, and
+    save the times for rand_partitions(..., method='best') to choose from.
+    
+    Arguments:
+        grid : a list of (q, n, zeros). Defaults to CALIBRATION_GRID
+        draws : the number of partitions each sampler generates at each point
+        time_limit : the seconds after which a sampler stops early at a point.
+            Its cost is then the time per partition generated so far
+        path : the file to save to. Defaults to calibration_path()
+        save : boolean if False the calibration is returned but not saved
+        rng : the source of random numbers, as for rand_partitions()
+    
+    Returns: the calibration, a dictionary as in the JSON file
+    
+    """
+    
+    if grid is None:
+        grid = CALIBRATION_GRID
+    points = []
+    for q, n, zeros in grid:
+        D = CountTable()
+        rand_partitions(q, n, 1, 'bottom_up', D, zeros, rng=rng) # fill the table
+        costs = {}
+        for method in SAMPLERS:
+            start = time.time()
+            done = 0
+            while done < draws:
+                rand_partitions(q, n, 1, method, D, zeros, rng=rng)
+                done += 1
+                if time.time() - start > time_limit:
+                    break
+            costs[method] = (time.time() - start) / done
+        points.append({'q': q, 'n': n, 'zeros': bool(zeros), 'costs': costs})
+    
+    model = {'version': 1, 'points': points}
+    if path is None:
+        path = calibration_path()
+    if save:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(model, f, indent=1)
+    _calibration[path] = model
+    return model
+
+
+def load_calibration(path=None):
+    """ Return the calibration saved by calibrate() at path (by default
+    calibration_path()), or None if there is none. Files are read once. """
+    
+    if path is None:
+        path = calibration_path()
+    if path not in _calibration:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            model = json.load(f)
+        if model.get('version') != 1:
+            raise ValueError(path + ' is not a calibration file')
+        _calibration[path] = model
+    return _calibration[path]
+
+
+def predict_costs(model, q, n, zeros):
+    """ Predict the seconds per partition of each sampler from the nearest point
+    of a calibration, or return None if the calibration has no point for zeros """
+    
+    nearest = None
+    for point in model['points']:
+        if point['zeros'] != bool(zeros):
+            continue
+        d = math.log(q / point['q']) ** 2 + (4 * (n / q - point['n'] / point['q'])) ** 2
+        if nearest is None or d < nearest[0]:
+            nearest = (d, point)
+    if nearest is None:
+        return None
+    point = nearest[1]
+    costs = {}
+    for method, cost in point['costs'].items():
+        costs[method] = cost * q / point['q']
+    return costs
+
+
+def default_method(q, n, zeros):
+    """ The sampler for q, n and zeros without a calibration, by the rules found
+    for rand_partitions() in 2013 """
+    
+    if zeros:
+        q1 = q
+        if q1 < 350:
+            return 'bottom_up'
+        elif n < 0.4 * q1:
+            return 'divide_and_conquer'
+        return 'bottom_up'
+    
+    q1 = q - n
+    if n < 0.1 * q1:
+        return 'multiplicity'
+    elif q < 500:
+        return 'bottom_up'
+    elif q > 500 and n < 0.25 * q1:
+        return 'divide_and_conquer'
+    return 'bottom_up'
+
+
+def explain(q, n, zeros=False, path=None):
+    """
+    Report the method rand_partitions(..., method='best') uses for q, n and zeros,
+    and why.
+    
+    Returns: a dictionary with
+        'method' : the method 'best' uses
+        'reason' : 'vectorized' if the feasible set fits the vectorized sampler,
+            'calibration' if the method has the lowest predicted cost, or
+            'default' if there is no calibration (see calibrate())
+        'costs' : the predicted seconds per partition of each sampler in
+            SAMPLERS, or None without a calibration
+    
+    """
+    
+    if q < n and zeros == False:
+        zeros = True
+    if zeros:
+        q1, kmax = q, min(n, q)
+    else:
+        q1, kmax = q - n, min(n, q - n)
+    
+    costs = None
+    model = load_calibration(path)
+    if model is not None:
+        costs = predict_costs(model, q, n, zeros)
+    
+    if (kmax + 1) * (q1 + kmax + 1) <= VECTORIZED_MAX_CELLS and \
+       CountTable().count(q1, kmax) < 2 ** 63:
+        return {'method': 'vectorized', 'reason': 'vectorized', 'costs': costs}
+    if costs is not None:
+        method = min(SAMPLERS, key=lambda m: costs.get(m, float('inf')))
+        return {'method': method, 'reason': 'calibration', 'costs': costs}
+    return {'method': default_method(q, n, zeros), 'reason': 'default', 'costs': None}
+
+
+def best_method(q, n, zeros):
+    """ The sampler rand_partitions(..., method='best') uses when the vectorized
+    sampler does not apply: the lowest predicted cost in the calibration, if any,
+    or else default_method() """
+    
+    model = load_calibration()
+    if model is not None:
+        costs = predict_costs(model, q, n, zeros)
+        if costs is not None:
+            return min(SAMPLERS, key=lambda m: costs.get(m, float('inf')))
+    return default_method(q, n, zeros)
+
+
+def rand_partitions(q, n, sample_size, method='best', D=None, zeros=False,
+                    cache_dir=None, rng=None, as_array=False, runs=False):
     """
     Generate uniform random partitions of Q having N parts.
     
@@ -152,24 +1084,58 @@ def rand_partitions(q, n, sample_size, method='best', D={}, zeros=False):
         N : Number of parts to sum over
         sample_size : number of random partitions to generate
         method : method to use for generating the partition, options include:
-            'bottom_up', 'top_down', 'divide_and_conquer', 'multiplicity', and
-            'best'. Defaults to 'best'
-        D : a dictionary for the number of partitions of Q having N or less
-            parts (or N or less as the largest part), i.e. P(Q, Q + N). Defaults
-            to a blank dictionary.
+            'bottom_up', 'top_down', 'divide_and_conquer', 'multiplicity',
+            'batch', 'vectorized' and 'best'. Defaults to 'best'
+        D : a CountTable (or a dictionary) for the number of partitions of Q
+            having N or less parts (or N or less as the largest part), i.e.
+            P(Q, Q + N). Defaults to a new, empty CountTable.
         zeros : boolean if True partitions can have zero values, if False
             partitions have only positive values, defaults to False
+        cache_dir : a directory where count tables are stored between runs. If
+            given (and D is not), the CountTable for Q, N and zeros is loaded
+            from cache_dir, or built and saved there if no run has stored it
+            yet. Defaults to None, i.e. no cache.
+        rng : the source of random numbers: a random.Random, a
+            numpy.random.Generator, or None for the random module. Callers in
+            separate threads should each pass their own rng (and D).
+        as_array : boolean if True the partitions are written into a numpy array
+            of shape (sample_size, N), of the smallest integer dtype that holds
+            Q (see part_dtype()), instead of a list of lists. Defaults to False
+        runs : boolean if True each partition is returned in run-length form, a
+            list of (value, count) pairs (see to_runs()), with any zeros as a
+            last run of value 0. The 'multiplicity' method (and 'best' when it
+            uses it) builds the partitions in this form without ever expanding
+            them. Cannot be combined with as_array. Defaults to False
     
-    Returns: A list of lists
+    Returns: A list of lists, or an array with one partition per row
     
     Notes:
         method == 'best' attempts to use the values of Q and N to infer what the 
-        fastest method to compute the partition.
+        fastest method to compute the partition. It uses 'vectorized' where that
+        applies, and otherwise the sampler with the lowest cost predicted by the
+        saved calibration (see calibrate() and explain()), or, without one, the
+        rules of default_method().
+        
+        method == 'batch' draws all sample_size ranks first and generates the
+        partitions together with batch_bottom_up(), which pays off when
+        sample_size is large relative to the size of the feasible set. The
+        partitions are returned in random order.
+        
+        method == 'vectorized' generates the partitions together with
+        vectorized_bottom_up(), in numpy arrays instead of Python loops. It
+        applies when the size of the feasible set fits in an int64 and its table
+        of counts has no more than VECTORIZED_MAX_CELLS cells, and 'best' uses it
+        whenever it applies. Otherwise, 'vectorized' falls back to 'bottom_up'.
     
     """
     if q < n and zeros == False:
         zeros = True
     
+    if D is None and cache_dir is not None:
+        D = cached_count_table(q, n, zeros, cache_dir)
+    elif D is None:
+        D = CountTable()
+    
     parts = []
     if zeros:
     
@@ -191,8 +1157,66 @@ def rand_partitions(q, n, sample_size, method='best', D={}, zeros=False):
         
     D = Plist[0]
     numparts = Plist[1]        
-    while len(parts) < sample_size:
-        rand_int = random.randrange(1, numparts + 1)
+    
+    if zeros:
+        q1 = q
+    else:
+        q1 = q - n
+    kmax = min(n, q1)
+    vectorizable = (numparts < 2 ** 63 and
+                    (kmax + 1) * (q1 + kmax + 1) <= VECTORIZED_MAX_CELLS)
+    if method == 'best' and vectorizable:
+        method = 'vectorized'
+    elif method == 'best':
+        method = best_method(q, n, zeros)
+    
+    if as_array and runs:
+        raise ValueError('as_array and runs cannot both be True')
+    if as_array:
+        out = np.zeros((sample_size, n), dtype=part_dtype(q))
+    else:
+        out = None
+    
+    if method == 'vectorized' and vectorizable:
+        ranks = rand_ranks(rng, numparts, sample_size)
+        T = None
+        if isinstance(D, CountTable):
+            T = D.dense_table(q1, kmax)
+        parts = vectorized_bottom_up(q1, n, np.array(ranks, dtype=np.int64), out, T)
+        if not zeros:
+            parts += 1
+        if as_array:
+            return parts
+        if runs:
+            return [to_runs(part) for part in parts.tolist()]
+        return parts.tolist()
+    elif method == 'vectorized':
+        method = 'bottom_up'
+    
+    if method == 'batch':
+        ranks = sorted(rand_ranks(rng, numparts, sample_size))
+        if zeros:
+            parts = batch_bottom_up([], q, n, D, ranks)
+        else:
+            parts = batch_bottom_up([n], q - n, n, D, ranks)
+        if rng is None:
+            random.shuffle(parts)
+        else:
+            rng.shuffle(parts)
+        if as_array:
+            for i, part in enumerate(parts):
+                out[i, :len(part)] = part
+            return out
+        if zeros:
+            for part in parts:
+                part.extend([0] * (n - len(part)))
+        if runs:
+            return [to_runs(part) for part in parts]
+        return parts
+    
+    conj = not as_array # the array is filled from the unconjugated partitions
+    for i in range(sample_size):
+        rand_int = randrange(rng, 1, numparts + 1)
         
         if zeros:
             q1 = int(q)
@@ -202,109 +1226,583 @@ def rand_partitions(q, n, sample_size, method='best', D={}, zeros=False):
             part = [n]
         
         if method == 'bottom_up':
-            part = bottom_up(part, q1, D, rand_int)
+            part = bottom_up(part, q1, D, rand_int, conj)
         
         if method == 'top_down':
-            part = top_down(part, q1, D, rand_int)
+            part = top_down(part, q1, D, rand_int, conj)
         
         if method == 'divide_and_conquer':
-            part = divide_and_conquer(part, q1, n, D, rand_int)
+            part = divide_and_conquer(part, q1, n, D, rand_int, rng, conj)
         
         if method == 'multiplicity':
-            part = multiplicity(part, q1, D, rand_int)
+            part = multiplicity(to_runs(part) if runs else part, q1, D, rand_int, runs, conj)
         
-        if method == 'best' and zeros == True:
-            if q1 < 350 :
-                part = bottom_up(part, q1, D, rand_int)
-            elif n < 0.4 * q1:
-                part = divide_and_conquer(part, q1, n, D, rand_int)
-            else:
-                part = bottom_up(part, q1, D, rand_int)
-                
-        elif method == 'best' and zeros == False:
-            if n < 0.1 * q1:
-                part = multiplicity(part, q1, D, rand_int)
-            elif q < 500:
-                part = bottom_up(part, q1, D, rand_int)    
-            elif q > 500 and n < 0.25*q1:
-                part = divide_and_conquer(part, q1, n, D, rand_int)
-            else:
-                bottom_up(part, q1, D, rand_int)
-                
-                
+        if as_array:
+            conjugate_into(part, out[i])
+            continue
+        if runs:
+            if part == [] or type(part[0]) is not tuple: # not built as runs
+                part = to_runs(part)
+            size = 0
+            for value, count in part:
+                size += count
+            if size < n:
+                part.append((0, n - size))
+            parts.append(part)
+            continue
         if zeros:
             Zs = [0] * (n - len(part))
             part.extend(Zs)
         parts.append(part)
+    if as_array:
+        return out
     return parts
 
 
-def bottom_up(part, q, D, rand_int):
+def rand_partitions_many(pairs, sample_size, method='best', D=None, zeros=False,
+                         rng=None, as_array=False):
+    """
+    Generate uniform random partitions for each of many (Q, N) pairs, e.g. the
+    sites of a data set, from one shared CountTable.
+    
+    The table for a pair is the corner of the table for the largest pair, so the
+    pairs are sampled in order of the extent of table they need, smallest
+    first, and each extends the shared table only by what it lacks. Where the
+    'vectorized' method applies, its dense table is likewise built once, to the
+    largest extent needed, and shared.
+    
+    Arguments:
+        pairs : a list of (Q, N) pairs
+        sample_size : number of random partitions to generate for each pair
+        method, zeros, rng, as_array : as for rand_partitions()
+        D : the shared CountTable. Defaults to a new, empty CountTable
+    
+    Returns: a dictionary of the partitions of each (Q, N) pair
+    
+    """
+    
+    samples = {}
+    for pair, sample in iter_rand_partitions_many(pairs, sample_size, method, D,
+                                                  zeros, rng, as_array):
+        samples[pair] = sample
+    return samples
+
+
+def iter_rand_partitions_many(pairs, sample_size, method='best', D=None, zeros=False,
+                              rng=None, as_array=False):
+    """
+    Generate the samples of rand_partitions_many() one (Q, N) pair at a time,
+    yielding each as it is drawn, so the caller can reduce a sample before the
+    next is made and only one sample is held at once. The pairs are yielded in
+    the order they are sampled, of the extent of table they need, and the
+    arguments are as for rand_partitions_many().
+    
+    Yields: ((Q, N), partitions) for each pair
+    
+    """
+    
+    if D is None:
+        D = CountTable()
+    extents = []
+    for q, n in pairs:
+        z = zeros or q < n
+        q1 = q if z else q - n
+        extents.append((q1, min(n, q1), q, n))
+    extents.sort()
+    
+    if method in ('best', 'vectorized'): # the dense table of the vectorizable pairs
+        qmax, kmax = -1, -1
+        for q1, k, q, n in extents:
+            if (k + 1) * (q1 + k + 1) <= VECTORIZED_MAX_CELLS and D.count(q1, k) < 2 ** 63:
+                qmax, kmax = max(qmax, q1), max(kmax, k)
+        if qmax >= 0 and (kmax + 1) * (qmax + kmax + 1) <= VECTORIZED_MAX_CELLS:
+            D.dense_table(qmax, kmax)
+    
+    for q1, k, q, n in extents:
+        yield (q, n), rand_partitions(q, n, sample_size, method, D, zeros,
+                                      rng=rng, as_array=as_array)
+
+
+def iter_rand_partitions(q, n, sample_size, method='best', D=None, zeros=False,
+                         cache_dir=None, rng=None, chunk_size=10000, as_array=True):
+    """
+    Generate uniform random partitions of Q having N parts chunk_size at a time,
+    yielding each chunk as it is made, so a sample of any size can be streamed
+    in the memory of one chunk. Every chunk is drawn by rand_partitions() with
+    the same CountTable, which is built for the first chunk only.
+    
+    Arguments:
+        Q : Total sum across parts
+        N : Number of parts to sum over
+        sample_size : number of random partitions to generate, or None to
+            generate chunks without end
+        method, D, zeros, cache_dir, rng : as for rand_partitions()
+        chunk_size : the number of partitions in each chunk
+        as_array : boolean if True each chunk is a numpy array with one
+            partition per row, as for rand_partitions(), and if False a list of
+            lists. Defaults to True
+    
+    Yields: chunks of chunk_size partitions, the last of them possibly smaller
+    
+    """
+    
+    if D is None and cache_dir is not None:
+        D = cached_count_table(q, n, zeros or q < n, cache_dir)
+    elif D is None:
+        D = CountTable()
+    remaining = sample_size
+    while remaining is None or remaining > 0:
+        size = chunk_size
+        if remaining is not None:
+            size = min(chunk_size, remaining)
+            remaining -= size
+        yield rand_partitions(q, n, size, method, D, zeros, rng=rng, as_array=as_array)
+
+
+_worker_tables = {} # CountTables kept by each worker process of parallel_rand_partitions()
+
+
+def _sample_chunk(args):
+    """ Generate one chunk of parallel_rand_partitions(), with a numpy Generator
+    seeded by the chunk's SeedSequence """
+    
+    q, n, size, method, zeros, cache_dir, seed_seq = args
+    key = (q, n, zeros or q < n) # rand_partitions() allows zeros when q < n
+    if key not in _worker_tables:
+        if cache_dir is not None:
+            _worker_tables[key] = cached_count_table(q, n, key[2], cache_dir)
+        else:
+            _worker_tables[key] = CountTable()
+    return rand_partitions(q, n, size, method, _worker_tables[key], zeros,
+                           rng=np.random.default_rng(seed_seq))
+
+
+def parallel_rand_partitions(q, n, sample_size, seed, workers=None, method='best',
+                             zeros=False, cache_dir=None, chunk_size=10000):
+    """
+    Generate uniform random partitions of Q having N parts with a pool of
+    worker processes, reproducibly.
+    
+    The sample is split into chunks of chunk_size partitions, and each chunk is
+    generated from its own random stream, seeded by one of the SeedSequences
+    spawned from seed. Which worker runs a chunk does not change the chunk, so
+    for a given seed and chunk_size the sample is the same whatever the number
+    of workers.
+    
+    Arguments:
+        Q : Total sum across parts
+        N : Number of parts to sum over
+        sample_size : number of random partitions to generate
+        seed : an integer (or a numpy SeedSequence) the sample is generated from
+        workers : the number of worker processes. Defaults to the number of CPUs
+        method, zeros, cache_dir : as for rand_partitions(). With cache_dir, the
+            workers share the count table through the files in cache_dir
+        chunk_size : the number of partitions generated from each random stream
+    
+    Returns: A list of lists
+    
+    """
+    
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    sizes = [chunk_size] * (sample_size // chunk_size)
+    if sample_size % chunk_size:
+        sizes.append(sample_size % chunk_size)
+    streams = seed.spawn(len(sizes))
+    chunks = [(q, n, size, method, zeros, cache_dir, stream)
+              for size, stream in zip(sizes, streams)]
+    
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in pool.map(_sample_chunk, chunks):
+            parts.extend(chunk)
+    return parts
+
+
+class FeasibleSet(object):
+    """ The feasible set of q and n: the partitions of q having exactly n parts,
+    or n or less parts padded with zeros to n when zeros is True, in the order
+    in which bottom_up() maps ranks to partitions.
+    
+    Members are numbered from 0 to size - 1. unrank(i) (or set[i]) gives the
+    member numbered i, and rank(partition) its number, each in O(log n) look
+    ups of P per part of the conjugate. Slices give lists of members, and
+    sample(k) gives k distinct members at random, without building a list of
+    all ranks, so that work on a set too large to list can be split by rank
+    range, deduplicated by rank, or resumed from a rank.
+    
+    len(set) is the size of the set, but python limits len() to sys.maxsize,
+    so use set.size for sets of any size.
+    
+    Arguments:
+        q : Total sum across parts
+        n : Number of parts to sum over
+        zeros : boolean if True partitions can have zero values
+        D : the CountTable of the set
+        size : the number of partitions in the set
+    
+    """
+    
+    def __init__(self, q, n, zeros=False, D=None):
+        if q < n and zeros == False:
+            zeros = True
+        self.q = q
+        self.n = n
+        self.zeros = zeros
+        if D is None:
+            D = CountTable()
+        self.D = D
+        if zeros:
+            self.q1 = q
+        else:
+            self.q1 = q - n
+        Plist = P(D, self.q1, min(n, self.q1))
+        self.D = Plist[0]
+        self.size = Plist[1]
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.unrank(j) for j in range(*i.indices(self.size))]
+        return self.unrank(i)
+    
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.unrank(i)
+    
+    def __contains__(self, partition):
+        try:
+            self.rank(partition)
+        except ValueError:
+            return False
+        return True
+    
+    def unrank(self, i):
+        """ Return the member numbered i (from 0; negative i count from the end) """
+        
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError('rank out of range')
+        if self.zeros:
+            part = []
+        else:
+            part = [self.n]
+        part = bottom_up(part, self.q1, self.D, i + 1)
+        part.extend([0] * (self.n - len(part)))
+        return part
+    
+    def rank(self, partition):
+        """ Return the number of a member, i.e. i with unrank(i) == partition.
+        The parts can be in any order. Raises ValueError if partition is not
+        in the set. """
+        
+        partition = sorted(partition, reverse=True)
+        if len(partition) != self.n or sum(partition) != self.q or \
+           (partition != [] and partition[-1] < (0 if self.zeros else 1)):
+            raise ValueError('partition is not in the feasible set')
+        while partition != [] and partition[-1] == 0:
+            partition.pop()
+        walk = conjugate(partition)
+        if not self.zeros:
+            walk = walk[1:] # the first part, n, is fixed
+        
+        # bottom_up() takes the smallest k having P(q, k) >= rand_int and then
+        # subtracts P(q, k - 1), so the rank is the sum of those counts
+        i = 0
+        q = self.q1
+        for k in walk:
+            Plist = P(self.D, q, k - 1)
+            self.D = Plist[0]
+            i += Plist[1]
+            q -= k
+        return i
+    
+    def sample(self, k, rng=None):
+        """ Return k distinct members at random, in random order. The ranks are
+        drawn one at a time and redrawn if already drawn, unless k is over half
+        the size of the set, in which case the set is small enough to shuffle.
+        
+        Arguments:
+            k : the number of members
+            rng : the source of random numbers, as for rand_partitions()
+        
+        """
+        
+        if k > self.size:
+            raise ValueError('sample larger than the feasible set')
+        if 2 * k > self.size:
+            ranks = list(range(self.size))
+            if rng is None:
+                random.shuffle(ranks)
+            else:
+                rng.shuffle(ranks)
+            ranks = ranks[:k]
+        else:
+            ranks = []
+            drawn = set()
+            while len(ranks) < k:
+                i = randrange(rng, 0, self.size)
+                if i not in drawn:
+                    drawn.add(i)
+                    ranks.append(i)
+        return [self.unrank(i) for i in ranks]
+
+
+def smallest_k(D, q, rand_int, lo, hi):
+    """ Find the smallest k, lo <= k <= hi, for which P(q, k) >= rand_int, by
+    bisection. P(q, k) never decreases as k grows, and P(q, hi) >= rand_int.
+    
+    Arguments:
+        D : a CountTable or a dictionary for the number of partitions of q
+            having k or less parts (or k or less as the largest part)
+        q : the total sum of the partition
+        rand_int : a number representing a member of the feasible set
+        lo, hi : the smallest and largest values of k to consider
+    
+    Returns: the updated dictionary and k """
+    
+    while lo < hi:
+        mid = (lo + hi) // 2
+        Plist = P(D, q, mid)
+        D = Plist[0]
+        if Plist[1] >= rand_int:
+            hi = mid
+        else:
+            lo = mid + 1
+    return [D, lo]
+
+
+def bottom_up(part, q, D, rand_int, conj=True):
     """
     Bottom up method of generating uniform random partitions of q having n parts.
     
+    The first/largest part is the smallest k having P(q, k) >= rand_int. It is
+    found by trying k = 1, 2, 4, 8, ... until P(q, k) >= rand_int, and then by
+    bisection between the last two values tried, i.e. O(log k) look ups of P.
+    
     Arguments:
         part : a list to hold the partition
         q : the total sum of the partition
-        D : a dictionary for the number of partitions of q having n or less
-            parts (or n or less as the largest part), i.e. P(q + n, n).        
+        D : a CountTable or a dictionary for the number of partitions of q
+            having n or less parts (or n or less as the largest part), i.e. P(q + n, n).        
         rand_int : a number representing a member of the feasible set
+        conj : boolean if False the partition is returned before its final
+            conjugation, i.e. with n or less as the largest part. Defaults to True
 
     """    
     
     while q > 0:
-        for k in range(1, q + 1): # loop through all possible values of the first/largest part
+        lo = 1
+        k = 1
+        while True: # loop through k = 1, 2, 4, ... as values of the first/largest part
             Plist = P(D, q, k) # number of partitions of q having k or less as the largest part
             D = Plist[0]
-            count = Plist[1]
-            if count >= rand_int:
-                Plist = P(D, q, k - 1)
-                D = Plist[0]
-                count = Plist[1]
+            if Plist[1] >= rand_int:
                 break
+            lo = k + 1
+            k = min(2 * k, q)
+        Klist = smallest_k(D, q, rand_int, lo, k)
+        D = Klist[0]
+        k = Klist[1]
+        Plist = P(D, q, k - 1)
+        D = Plist[0]
+        count = Plist[1]
         part.append(k)
         q -= k
         if q == 0:
             break
         rand_int -= count
-    part = conjugate(part)    
+    if conj:
+        part = conjugate(part)
     return(part)
 
 
-def top_down(part, q, D, rand_int):
+def top_down(part, q, D, rand_int, conj=True):
     """
     Top down method of generating uniform random partitions of q having n parts.
     
+    The first/largest part is the smallest k, no larger than the last part, having
+    P(q, k) >= rand_int. It is found by bisection, i.e. O(log k) look ups of P.
+    
     Arguments:
         part : a list to hold the partition
         q : the total sum of the partition
-        D : a dictionary for the number of partitions of q having n or less
-            parts (or n or less as the largest part), i.e. P(q + n, n).        
+        D : a CountTable or a dictionary for the number of partitions of q
+            having n or less parts (or n or less as the largest part), i.e. P(q + n, n).        
         rand_int : a number representing a member of the feasible set
+        conj : boolean if False the partition is returned before its final
+            conjugation, i.e. with n or less as the largest part. Defaults to True
 
     """    
     
     while q > 0:
         if part != []: 
-            x = min(part)
+            x = part[-1] # the parts never increase, so this is min(part)
         else: 
             x = q
-        for k in reversed(range(1, x + 1)): # loop through all possible values of the first/largest part
-            Plist = P(D, q, k) # number of partitions of q having k or less as the
-            # largest part
-            D = Plist[0]
-            count = Plist[1]
-            if count < rand_int:
-                k += 1
-                break
+        Klist = smallest_k(D, q, rand_int, 1, x)
+        D = Klist[0]
+        k = Klist[1]
+        Plist = P(D, q, k - 1) # number of partitions of q having k-1 or less as the
+        # largest part
+        D = Plist[0]
+        count = Plist[1]
         rand_int -= count
         part.append(k)
         q -= k
-    part = conjugate(part)
+    if conj:
+        part = conjugate(part)
     return(part)
 
 
-def divide_and_conquer(part, q, n, D, rand_int):
+def batch_bottom_up(part, q, n, D, ranks):
+    """
+    Batch method of generating uniform random partitions of q having n parts.
+    Each rank is mapped to the same partition as by bottom_up(), but the ranks
+    are walked down the count table together, like a trie.
+    
+    At each step, the ranks of a group share the parts found so far. Because the
+    ranks are sorted, the ranks that share the next part, k, are a contiguous run
+    of the group, found by bisection at P(q, k). Each run then continues as a
+    group of its own. The parts shared by a group are found once, however many
+    ranks the group holds, and a group of a single rank is finished by
+    bottom_up().
+    
+    Arguments:
+        part : a list holding the parts that every partition starts with
+        q : the total sum of the partition
+        n : the largest value of the first/largest part
+        D : a CountTable or a dictionary for the number of partitions of q
+            having n or less parts (or n or less as the largest part), i.e. P(q + n, n).
+        ranks : a sorted list of numbers, each representing a member of the
+            feasible set
+    
+    Returns: a list of partitions, one for each rank and in the order of ranks
+    
+    """
+    
+    partitions = [None] * len(ranks)
+    # a group: the remainder of q, the first and last + 1 index of its ranks, the
+    # number of members preceding the group, its parts (as a linked list of
+    # (k, parent)) and the largest value its next part can take
+    groups = [(q, 0, len(ranks), 0, None, min(n, q))]
+    while groups:
+        q, lo, hi, offset, prefix, kmax = groups.pop()
+        
+        if q == 0 or hi - lo == 1:
+            shared = []
+            node = prefix
+            while node is not None:
+                shared.append(node[0])
+                node = node[1]
+            shared = part + shared[::-1]
+            
+            if q == 0:
+                partition = conjugate(shared)
+                for j in range(lo, hi):
+                    partitions[j] = list(partition)
+            else:
+                partitions[lo] = bottom_up(shared, q, D, ranks[lo] - offset)
+            continue
+        
+        i = lo
+        while i < hi:
+            Klist = smallest_k(D, q, ranks[i] - offset, 1, kmax)
+            D = Klist[0]
+            k = Klist[1]
+            lower = P(D, q, k - 1)[1]
+            upper = P(D, q, k)[1]
+            j = bisect.bisect_right(ranks, offset + upper, i, hi)
+            groups.append((q - k, i, j, offset + lower, (k, prefix), min(k, q - k)))
+            i = j
+    return partitions
+
+
+VECTORIZED_MAX_CELLS = 2 ** 23 # largest table, in int64 cells, used by vectorized_bottom_up()
+
+
+def dense_counts(q, k):
+    """ Return an int64 array T of shape (k + 1, q + 1) with T[i, m] the number of
+    partitions of m having i or less as the largest part, for i <= k and m <= q.
+    Row i is row i - 1 plus row i shifted by i, i.e. a cumulative sum with stride
+    i, found by summing the columns of row i laid out in blocks of i. The caller
+    must check that P(q, k) fits in an int64. """
+    
+    T = np.zeros((k + 1, q + k + 1), dtype=np.int64)
+    T[0, 0] = 1
+    for i in range(1, k + 1):
+        row = T[i]
+        row[:] = T[i - 1]
+        view = row[:-(-(q + 1) // i) * i].reshape(-1, i)
+        np.add.accumulate(view, axis=0, out=view)
+    return T[:, :q + 1]
+
+
+def vectorized_bottom_up(q, n, ranks, out=None, T=None):
+    """
+    Lock-step method of generating uniform random partitions of q having n or
+    less parts, for counts that fit in an int64. Each rank is mapped to the same
+    partition as by bottom_up(), but all ranks advance together: the remaining
+    totals, ranks and largest parts are held in numpy arrays, and each step finds
+    the next part of every unfinished partition by a vectorized bisection in a
+    dense table of P. The number of times each part occurs is tallied, and the
+    conjugate is read off the tallies as a cumulative sum, so the partitions come
+    out with exactly n parts (padded with zeros) and no per-partition Python work.
+    
+    Arguments:
+        q : the total sum of the partition
+        n : the largest number of parts
+        ranks : an int64 array of numbers, each representing a member of the
+            feasible set, i.e. from 1 to P(q, n)
+        out : an array of zeros of shape (len(ranks), n) to write the partitions
+            into. Defaults to a new int64 array
+        T : a table from dense_counts() covering q and min(n, q), e.g. from
+            CountTable.dense_table(). Defaults to a new one
+    
+    Returns: out, one partition per row, each with its parts in decreasing order
+    
+    """
+    
+    ranks = np.asarray(ranks, dtype=np.int64)
+    kmax = min(n, q)
+    if T is None:
+        T = dense_counts(q, kmax)
+    steps = max(kmax, 1).bit_length()
+    if out is None:
+        out = np.zeros((len(ranks), n), dtype=np.int64)
+    chunk = max(1, 2 ** 22 // (kmax + 1))
+    for start in range(0, len(ranks), chunk):
+        rs = ranks[start:start + chunk].copy()
+        tally = np.zeros((len(rs), kmax + 1), dtype=np.int64)
+        idx = np.arange(len(rs))
+        qs = np.full(len(rs), q, dtype=np.int64)
+        caps = np.full(len(rs), kmax, dtype=np.int64)
+        keep = qs > 0
+        idx, qs, rs, caps = idx[keep], qs[keep], rs[keep], caps[keep]
+        while idx.size:
+            lo = np.ones(idx.size, dtype=np.int64)
+            hi = caps
+            for step in range(steps): # the smallest k, lo <= k <= hi, having P(q, k) >= rank
+                mid = (lo + hi) >> 1
+                found = T[mid, qs] >= rs
+                hi = np.where(found, mid, hi)
+                lo = np.where(found, lo, mid + 1)
+            k = hi
+            tally[idx, k] += 1
+            rs -= T[k - 1, qs]
+            qs -= k
+            caps = np.minimum(k, qs)
+            keep = qs > 0
+            idx, qs, rs, caps = idx[keep], qs[keep], rs[keep], caps[keep]
+        # the i-th largest part of the conjugate is the number of parts >= i
+        out[start:start + len(tally), :kmax] = np.cumsum(tally[:, :0:-1], axis=1)[:, ::-1]
+    return out
+
+
+def divide_and_conquer(part, q, n, D, rand_int, rng=None, conj=True):
     """
     Divide and conquer method of generating uniform random partitions of q
     having n parts.
@@ -313,9 +1811,12 @@ def divide_and_conquer(part, q, n, D, rand_int):
         part : a list to hold the partition
         q : the total sum of the partition
         n : number of parts to sum over
-        D : a dictionary for the number of partitions of q having n or less
-            parts (or n or less as the largest part), i.e. P(q + n, n).        
+        D : a CountTable or a dictionary for the number of partitions of q
+            having n or less parts (or n or less as the largest part), i.e. P(q + n, n).        
         rand_int : a number representing a member of the feasible set
+        rng : the source of random numbers, as for rand_partitions()
+        conj : boolean if False the partition is returned before its final
+            conjugation, i.e. with n or less as the largest part. Defaults to True
 
     """
     #if n >= 1 and isinstance(n, int): pass 
@@ -324,7 +1825,7 @@ def divide_and_conquer(part, q, n, D, rand_int):
     max_int = int(n)
     min_int = int(1)
     while q > 0:
-        k = random.randrange(min_int, max_int + 1) # choose a value of the largest part at random
+        k = randrange(rng, min_int, max_int + 1) # choose a value of the largest part at random
         Plist = P(D, q, k)
         D = Plist[0]
         upper = Plist[1]
@@ -337,12 +1838,13 @@ def divide_and_conquer(part, q, n, D, rand_int):
             max_int = k
             min_int = 1
             num = int(upper - lower)
-            rand_int = random.randrange(1, num + 1)
+            rand_int = randrange(rng, 1, num + 1)
         elif rand_int > upper:
             min_int = k + 1    
         elif rand_int <= lower:
             max_int = k - 1    
-    part = conjugate(part)
+    if conj:
+        part = conjugate(part)
     return part
 
 
@@ -356,14 +1858,22 @@ def get_multiplicity(q, k, D, rand_int, count):
     Arguments:
         q : the total sum of the partition
         k : size of the largest (and also first) part 
-        D : a dictionary for the number of partitions of q-k*f having k-1 or less
-            parts (or k-1 or less as the largest part).                
+        D : a CountTable or a dictionary for the number of partitions of q-k*f
+            having k-1 or less parts (or k-1 or less as the largest part).                
         rand_int : a number representing a member of the feasible set
         count : number of partitions of q-k*f having k-1 or less parts 
         f : number of times k occur
         multi : list of f values of k """
         
-    multi = [] # the multiplicity 
+    Flist = find_multiplicity(q, k, D, rand_int, count)
+    multi = [k] * Flist[2] # the multiplicity 
+    return [Flist[0], Flist[1], multi]
+
+
+def find_multiplicity(q, k, D, rand_int, count):
+    """ As get_multiplicity(), but return the number of times f that k occurs
+    instead of a list of f values of k """
+    
     f = 1
     while f > 0:
         Plist = P(D, (q - k * f), k - 1)
@@ -371,13 +1881,12 @@ def get_multiplicity(q, k, D, rand_int, count):
         count += Plist[1]
         if count >= rand_int:
             count -= Plist[1]
-            multi = [k] * f
             break                
         f += 1
-    return [D, count, multi]
+    return [D, count, f]
 
 
-def multiplicity(part, q, D, rand_int):
+def multiplicity(part, q, D, rand_int, runs=False, conj=True):
     """
     multiplicity method of generating uniform random partitions of q having n
     parts.
@@ -386,11 +1895,19 @@ def multiplicity(part, q, D, rand_int):
         part : a list to hold the partition
         q : the total sum of the partition
         k : size of the largest (and also first) part 
-        D : a dictionary for the number of partitions of q having n or less
-            parts (or n or less as the largest part), i.e. P(q + n, n).        
+        D : a CountTable or a dictionary for the number of partitions of q
+            having n or less parts (or n or less as the largest part), i.e. P(q + n, n).        
         rand_int : a number representing a member of the feasible set
+        runs : boolean if True part is in run-length form (a list of (value, count)
+            pairs), and the partition is returned in the same form. The parts are
+            then never expanded, so the cost is in the number of distinct parts
+        conj : boolean if False the partition is returned before its final
+            conjugation, i.e. with n or less as the largest part. Defaults to True
 
     """
+    if runs:
+        return multiplicity_runs(part, q, D, rand_int, conj)
+    
     while q > 0:
         multi = []
         if part != []:
@@ -416,8 +1933,44 @@ def multiplicity(part, q, D, rand_int):
         q -= sum(multi)
         part.extend(multi)
         rand_int -= count    
-    part = conjugate(part)
+    if conj:
+        part = conjugate(part)
     return part
+
+
+def multiplicity_runs(runs, q, D, rand_int, conj=True):
+    """ The multiplicity() method of generating uniform random partitions of q
+    having n parts, with the partition held in run-length form throughout. See
+    multiplicity() for the arguments. """
+    
+    while q > 0:
+        if runs != []:
+            x = runs[-1][0]
+        else: 
+            x = int(q)
+        for k in reversed(range(1, x + 1)): # start with largest k
+            Plist = P(D, q, k) # number of partitions of q having k or less as the largest part
+            D = Plist[0]
+            count = Plist[1]
+            if count == rand_int and rand_int == 1:
+                k, f = 1, q
+                break
+            if count < rand_int: # k has been found
+                k += 1
+                Flist = find_multiplicity(q, k, D, rand_int, count)
+                D = Flist[0]
+                count = Flist[1]
+                f = Flist[2]
+                break
+        q -= k * f
+        if runs != [] and runs[-1][0] == k:
+            runs[-1] = (k, runs[-1][1] + f)
+        else:
+            runs.append((k, f))
+        rand_int -= count    
+    if conj:
+        runs = conjugate_runs(runs)
+    return runs
     
     
 def test_qnk(q, n=False, k=1):
@@ -524,32 +2077,300 @@ def first_lexical(q, n, k=None):
     return partition
 
 
+def next_lexical(partition):
+    """ Change a partition, a list of parts in decreasing order, into the next
+    lexical partition of its total having as many parts, in place. Return False,
+    leaving the partition unchanged, if it is the last lexical partition.
+    
+    The next partition decreases the rightmost part that exceeds the last part
+    by more than one, and refills the parts after it with the first lexical
+    partition of what remains. The parts after it are a run of parts equal to
+    last + 1 followed by a run equal to last, so the part and the sum of the
+    parts after it are found from the ends of the two runs, by bisection. Only
+    the parts that change are rewritten: the refill keeps any of the run of
+    last + 1 that it writes over with the same value, and any trailing run of
+    1s. A step so takes O(log n), plus the number of parts that change. """
+    
+    n = len(partition)
+    last = partition[-1]
+    lo = 0
+    hi = n - 1
+    while lo < hi: # the first part no more than last + 1, by bisection
+        mid = (lo + hi) // 2
+        if partition[mid] > last + 1:
+            lo = mid + 1
+        else:
+            hi = mid
+    i = lo - 1
+    if i < 0:
+        return False
+    j = n - 1
+    while lo < j: # the first part equal to last, by bisection
+        mid = (lo + j) // 2
+        if partition[mid] > last:
+            lo = mid + 1
+        else:
+            j = mid
+    tail = (n - i - 1) * last + (j - i - 1) # the sum of the parts after i
+    
+    v = partition[i] - 1
+    partition[i] = v
+    m = n - i - 1 # the number of parts to refill, with a sum of tail + 1
+    extra = tail + 1 - m # what remains after a 1 in each part
+    if v > 1:
+        full = min(extra // (v - 1), m) # the number of parts equal to v
+    else:
+        full = m
+    start = i + 1
+    if v == last + 1: # the run of last + 1 already holds v
+        start = min(j, i + 1 + full)
+    partition[start:i + 1 + full] = [v] * (i + 1 + full - start)
+    if full < m:
+        partition[i + 1 + full] = 1 + extra - full * (v - 1)
+        ones = n
+        if last == 1: # the run of last already holds 1s
+            ones = max(j, i + 2 + full)
+        partition[i + 2 + full:ones] = [1] * (ones - i - 2 - full)
+    return True
+
+
+def iter_partitions(q, n, reuse=False):
+    """ Generate every partition of q having n parts, in lexical order, i.e. from
+    first_lexical(q, n) to last_lexical(q, n), each step made in place by
+    next_lexical().
+    
+    Arguments:
+        q : the total sum of the partition
+        n : number of parts in the partition
+        reuse : boolean if True the same list is yielded every time, changed in
+            place, so no list is made per partition. The consumer must then not
+            change it, nor keep it past the next step. Defaults to False, i.e. a
+            new list each time
+    
+    """
+    
+    partition = first_lexical(q, n, None)
+    while True:
+        if reuse:
+            yield partition
+        else:
+            yield list(partition)
+        if not next_lexical(partition):
+            return
+
+
+def shard_prefixes(q, n, depth=1):
+    """ Split the lexical order of the partitions of q having n parts into
+    shards, each the partitions starting with the same depth parts, and return
+    those leading parts (the prefix of each shard) in lexical order. The first
+    part takes the values from max_max(q, n) down to min_max(q, n), and each
+    following part is likewise bounded by the parts that remain. """
+    
+    depth = max(0, min(depth, n - 1))
+    prefixes = [[]]
+    for d in range(depth):
+        longer = []
+        for prefix in prefixes:
+            r = q - sum(prefix)
+            m = n - len(prefix)
+            hi = max_max(r, m)
+            if prefix != []:
+                hi = min(hi, prefix[-1])
+            for k in range(hi, min_max(r, m) - 1, -1):
+                longer.append(prefix + [k])
+        prefixes = longer
+    return prefixes
+
+
+def iter_shard(q, n, prefix, reuse=False):
+    """ Generate the partitions of q having n parts that start with the parts in
+    prefix, in lexical order, as iter_partitions() does for the whole set """
+    
+    d = len(prefix)
+    partition = list(prefix)
+    r = q - sum(prefix)
+    m = n - d
+    cap = prefix[-1] if prefix != [] else r
+    for j in range(m): # the first lexical partition of r into m parts of at most cap
+        k = min(cap, r - (m - j - 1))
+        partition.append(k)
+        r -= k
+    
+    while True:
+        if reuse:
+            yield partition
+        else:
+            yield list(partition)
+        if not next_lexical(partition) or partition[:d] != prefix:
+            return
+
+
+def _enumerate_shard(args):
+    """ Apply the reducer of enumerate_partitions() to one shard """
+    
+    q, n, prefix, reducer, reuse = args
+    return reducer(iter_shard(q, n, prefix, reuse))
+
+
+def enumerate_partitions(q, n, reducer, workers=None, depth=1, reuse=True):
+    """
+    Enumerate every partition of q having n parts on a pool of worker processes.
+    The lexical order is split into shards by shard_prefixes(), and each shard is
+    enumerated by iter_shard() in a worker, which passes it to reducer.
+    
+    Arguments:
+        q : the total sum of the partition
+        n : number of parts in the partition
+        reducer : a function taking an iterator over the partitions of a shard and
+            returning a result for the shard, e.g. a count or a histogram. It
+            must be picklable, i.e. defined at the top level of a module
+        workers : the number of worker processes. Defaults to the number of CPUs
+        depth : the number of leading parts that define a shard. More shards
+            balance the load better
+        reuse : as for iter_partitions(). Defaults to True, so a reducer that
+            keeps partitions must copy them
+    
+    Returns: a list of the results of the shards, in lexical order
+    
+    """
+    
+    shards = [(q, n, prefix, reducer, reuse) for prefix in shard_prefixes(q, n, depth)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_enumerate_shard, shards))
+
+
 def next_restricted_part(partition):
-    """ Find the next lexical partition of q having n parts
+    """ Find the next lexical partition of q having n parts, or the first if
+    partition is the last
     q : the total sum of the partition
-    n : number of parts in the partition
-    halves : two halves of the partition """
+    n : number of parts in the partition """
     
     q = sum(partition)
     n = len(partition)
     test_qnk(q, n)
     
-    if partition == last_lexical(q, n):
+    partition = [int(x) for x in partition]
+    if not next_lexical(partition):
         return first_lexical(q, n, None)
+    return partition
+
 
-    for i in enumerate(reversed(partition)):
-        if i[1] - partition[-1] > 1:
-            if i[0] == (n - 1):
-                partition = first_lexical(q, n, int(i[1] - 1))
-                return partition
-            else:
-                halves = np.split(partition, [n - i[0] - 1])
-                h1 = list(halves[0])
-                h2 = list(halves[1])
-                next = list(first_lexical(int(sum(h2)), int(len(h2)), int(h2[0]) - 1))
-                return h1 + next
 
 
+""" Functions for the exact expected shape of the partitions in a feasible set,
+    i.e. of a uniform random partition of q having n parts, from the counts of
+    the table alone and without sampling. All sums are of python integers, and
+    each expectation is divided out once, at the end. """
+
+def expected_frequencies(q, n, zeros=False, D=None):
+    """
+    Find the expected number of parts equal to j, for j = 0 to the largest
+    possible part, i.e. the expected abundance-class frequencies (SSAD).
+    
+    The partitions of q having n parts with at least f parts equal to j are
+    those of q - f*j having n - f parts, with f parts of j added, so
+    
+        E[#parts = j] = sum over f >= 1 of p(q - f*j, n - f) / p(q, n)
+    
+    where p(Q, N) = P(Q - N, N) is the number of partitions of Q having exactly N
+    parts (or P(Q, N) for N or less parts, when zeros is True).
+    
+    Arguments:
+        q : Total sum across parts
+        n : Number of parts to sum over
+        zeros : boolean if True partitions can have zero values
+        D : a CountTable (or a dictionary) of P. Defaults to a new CountTable
+    
+    Returns: a list of floats, the expected number of parts equal to j at index j
+    
+    """
+    
+    if q < n and zeros == False:
+        zeros = True
+    if D is None:
+        D = CountTable()
+    
+    def count(Q, N): # the partitions of Q having (exactly, or at most) N parts
+        if N < 0 or Q < 0:
+            return 0
+        if not zeros:
+            Q -= N
+            if Q < 0:
+                return 0
+        Plist = P(D, Q, N)
+        return Plist[1]
+    
+    total = count(q, n)
+    largest = q if zeros else q - n + 1
+    freqs = [0.0] * (largest + 1)
+    parts = 0
+    for j in range(1, largest + 1):
+        numer = 0
+        f = 1
+        while f <= n and f * j <= q:
+            numer += count(q - f * j, n - f)
+            f += 1
+        freqs[j] = numer / total
+        parts += numer
+    freqs[0] = n - parts / total # the rest of the n parts are zeros
+    return freqs
+
+
+def expected_abundances(q, n, zeros=False, D=None):
+    """
+    Find the expected i-th largest part, for i = 1 to n, i.e. the expected rank-
+    abundance curve.
+    
+    The i-th largest part is the number of parts of at least i in the conjugate.
+    The conjugates are the partitions of q having n as the largest part, i.e. n
+    plus a partition of q - n having parts of no more than n (or, when zeros is
+    True, the partitions of q having parts of no more than n). As in
+    expected_frequencies(), that partition has an expected
+    
+        E[#parts = j] = sum over f >= 1 of P(q1 - f*j, n) / P(q1, n)
+    
+    parts equal to j, where q1 = q - n (or q), and so the i-th largest part
+    has the expected value 1 + sum over i <= j <= n of E[#parts = j] (without
+    the 1 when zeros is True).
+    
+    Arguments:
+        q : Total sum across parts
+        n : Number of parts to sum over
+        zeros : boolean if True partitions can have zero values
+        D : a CountTable (or a dictionary) of P. Defaults to a new CountTable
+    
+    Returns: a list of n floats, the expected value of the i-th largest part at
+        index i - 1
+    
+    """
+    
+    if q < n and zeros == False:
+        zeros = True
+    if D is None:
+        D = CountTable()
+    q1 = q if zeros else q - n
+    
+    Plist = P(D, q1, n)
+    D = Plist[0]
+    total = Plist[1]
+    numers = [0] * (n + 2) # numers[j] / total = E[#parts = j]
+    for j in range(1, n + 1):
+        f = 1
+        while f * j <= q1:
+            Plist = P(D, q1 - f * j, n)
+            D = Plist[0]
+            numers[j] += Plist[1]
+            f += 1
+    
+    curve = [0.0] * n
+    tail = 0
+    for i in range(n, 0, -1):
+        tail += numers[i]
+        if zeros:
+            curve[i - 1] = tail / total
+        else:
+            curve[i - 1] = (total + tail) / total
+    return curve
 
 
 def get_central_tendency(parts):
@@ -593,4 +2414,4 @@ def get_central_tendency(parts):
                 xpart = part
                 
     #percentile_evar = stats.percentileofscore(sample_evar,obs_evar)
-    return xpart
\ No newline at end of file
+    return xpart
\ No newline at end of file
@@ -3,8 +3,12 @@
 from __future__ import division
 import sys
 import os
+import shutil
+import tempfile
+import warnings
 import pypartitions as parts
-#import metrics as mt
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metrics'))
+import metrics as mt
 from os import path, access, R_OK  # W_OK for write permission
 from scipy.stats import gaussian_kde
 from matplotlib.pylab import *
@@ -101,6 +105,39 @@ def test_next_restricted_part():
         
     return
 
+def test_iter_partitions():
+    
+    print('\nTesting to ensure that iter_partitions() generates the feasible set in lexical order.')
+    q = 11
+    n = 4
+    answer = [[8,1,1,1], [7,2,1,1], [6,3,1,1], [6,2,2,1], [5,4,1,1], [5,3,2,1],
+              [5,2,2,2], [4,4,2,1], [4,3,3,1], [4,3,2,2], [3,3,3,2]]
+    if list(parts.iter_partitions(q, n)) != answer:
+        print('iter_partitions() is broken. Test 1 FAIL')
+    else:
+        print('iter_partitions() works. Test 1 PASS')
+    
+    q = 20
+    n = 5
+    reused = []
+    for partition in parts.iter_partitions(q, n, reuse=True):
+        reused.append(tuple(partition))
+    if len(set(reused)) != 84 or sorted(reused, reverse=True) != reused:
+        print('iter_partitions() is broken. Test 2 FAIL')
+    else:
+        print('iter_partitions() works. Test 2 PASS')
+    
+    shards = []
+    for prefix in parts.shard_prefixes(q, n, 2):
+        shards.extend(tuple(x) for x in parts.iter_shard(q, n, prefix))
+    if shards != reused:
+        print('iter_shard() is broken. Test 3 FAIL')
+    else:
+        print('iter_shard() works. Test 3 PASS')
+    
+    return
+
+
 def test_min_max():
     
     print('\nTesting to ensure the smallest maximum part is correctly calculated.')
@@ -175,6 +212,148 @@ def test_P():
     
     return
 
+def test_CountTable():
+    
+    print('\nTesting to ensure that the count table agrees with P() computed from NrParts().')
+    table = parts.CountTable()
+    D = {}
+    q = 60
+    k = 25
+    numparts = table.count(q, k)
+    answer = parts.P(D, q, k)[1]
+    if numparts != answer:
+        print('CountTable is broken. Test 1 FAIL')
+    else:
+        print('CountTable works. Test 1 PASS')
+    
+    fails = 0
+    for q in range(0, 40):
+        for k in range(0, 45):
+            if parts.P(table, q, k)[1] != parts.P(D, q, k)[1]:
+                fails += 1
+    if fails > 0:
+        print('CountTable is broken.',fails,'cells differ. Test 2 FAIL')
+    else:
+        print('CountTable works. Test 2 PASS')
+    
+    q = 12345
+    k = 123
+    answer = 488259162924433580696194373878466788895554319556195978121822180221785381227453675217103501271281020550492
+    numparts = parts.P(table, q, k)
+    if numparts[1] != answer:
+        print('CountTable is broken. Test 3 FAIL')
+    else:
+        print('CountTable works. Test 3 PASS')
+    
+    table = parts.CountTable()
+    fails = 0
+    for q in range(380, 430): # p(q) passes 2**64 at q = 417
+        if table.count(q, q) != parts.NrParts(q) or table.count(q, 9) != parts.P(D, q, 9)[1]:
+            fails += 1
+    if fails > 0:
+        print('CountTable is broken.',fails,'counts near 2**64 differ. Test 4 FAIL')
+    else:
+        print('CountTable works. Test 4 PASS')
+    
+    return
+
+def test_bounded_CountTable():
+    
+    print('\nTesting to ensure that a bounded count table stays within its budget and gives correct counts.')
+    table = parts.CountTable(max_cells=2000)
+    full = parts.CountTable()
+    fails = 0
+    for i in range(0, 20):
+        partitions = parts.rand_partitions(150, 30, 5, 'top_down', table)
+        for partition in partitions:
+            if sum(partition) != 150 or len(partition) != 30:
+                fails += 1
+    for q in range(0, 120, 7):
+        for k in range(0, 40, 3):
+            if table.count(q, k) != full.count(q, k):
+                fails += 1
+    if fails > 0:
+        print('bounded CountTable is broken. Test 1 FAIL')
+    else:
+        print('bounded CountTable works. Test 1 PASS')
+    
+    stats = table.stats()
+    if stats['evictions'] == 0 or stats['cells'] > 2000 + 150 or stats['hits'] == 0:
+        print('bounded CountTable is broken.',stats,'Test 2 FAIL')
+    else:
+        print('bounded CountTable works. Test 2 PASS')
+    
+    # a quarter of the cells should cost a few rebuilt rows per miss, not the
+    # whole table below the row read
+    table = parts.CountTable(max_cells=35165 // 4) # the unbounded table holds 35165
+    parts.rand_partitions(600, 60, 100, 'bottom_up', table, rng=random.Random(2))
+    stats = table.stats()
+    reads = stats['hits'] + stats['misses']
+    if stats['evictions'] > 2 * stats['misses'] or stats['misses'] > reads // 10:
+        print('bounded CountTable is slow.',stats,'Test 3 FAIL')
+    else:
+        print('bounded CountTable works. Test 3 PASS')
+    
+    # the dense table of 'vectorized' counts against the budget, and one kept
+    # for two extents must not outgrow VECTORIZED_MAX_CELLS
+    table = parts.CountTable(max_cells=5000)
+    partitions = parts.rand_partitions(300, 40, 50, 'vectorized', table)
+    wide = parts.CountTable()
+    parts.rand_partitions(50002, 2, 5, 'vectorized', wide)
+    parts.rand_partitions(380, 380, 5, 'vectorized', wide, zeros=True)
+    fails = 0
+    for partition in partitions:
+        if sum(partition) != 300 or len(partition) != 40:
+            fails += 1
+    if fails > 0 or len(table) > 5000 or wide.dense_cells() > parts.VECTORIZED_MAX_CELLS:
+        print('CountTable.dense_table() is broken.',table.stats(),wide.stats(),'Test 4 FAIL')
+    else:
+        print('CountTable.dense_table() works. Test 4 PASS')
+    
+    # a single miss frees the rows it builds as it goes, not after building all
+    table = parts.CountTable(max_cells=2000)
+    count = table.count(1000, 200)
+    if count != parts.CountTable().count(1000, 200) or table.stats()['peak_cells'] > 2000 + 2 * 1001:
+        print('bounded CountTable is broken.',table.stats(),'Test 5 FAIL')
+    else:
+        print('bounded CountTable works. Test 5 PASS')
+    
+    return
+
+def test_count_table_files():
+    
+    print('\nTesting to ensure that count tables are correctly stored on and loaded from disk.')
+    cache_dir = tempfile.mkdtemp()
+    
+    table = parts.cached_count_table(200, 40, False, cache_dir)
+    loaded = parts.cached_count_table(200, 40, False, cache_dir)
+    fails = 0
+    for q in range(0, 161):
+        for k in range(0, 41):
+            if table.count(q, k) != loaded.count(q, k):
+                fails += 1
+    if fails > 0:
+        print('load_count_table() is broken.',fails,'cells differ. Test 1 FAIL')
+    else:
+        print('load_count_table() works. Test 1 PASS')
+    
+    q = 12345
+    k = 123
+    answer = 488259162924433580696194373878466788895554319556195978121822180221785381227453675217103501271281020550492
+    if loaded.count(q, k) != answer:
+        print('load_count_table() is broken. Test 2 FAIL')
+    else:
+        print('load_count_table() works. Test 2 PASS')
+    
+    partitions = parts.rand_partitions(200, 40, 10, 'bottom_up', zeros=False, cache_dir=cache_dir)
+    if len(os.listdir(cache_dir)) != 1 or [sum(p) for p in partitions] != [200] * 10:
+        print('rand_partitions() is broken with cache_dir. Test 3 FAIL')
+    else:
+        print('rand_partitions() works with cache_dir. Test 3 PASS')
+    
+    shutil.rmtree(cache_dir)
+    return
+
 def test_NrParts():
     
     print('\nTesting to ensure the number of partitions for a given total (q) and number of parts (n) is correctly calculated.')
@@ -207,6 +386,34 @@ def test_NrParts():
         print('NrParts is broken. Test 4 FAIL')
     else:
         print('NrParts works. Test 4 PASS')
+    
+    q = 1000
+    answer = 24061467864032622473692149727991
+    numparts = parts.NrParts(q)
+    if numparts != answer:
+        print('NrParts is broken. Test 5 FAIL')
+    else:
+        print('NrParts works. Test 5 PASS')
+    
+    fails = 0
+    for q in range(2, 300):
+        if parts.rademacher(q) != parts.NrParts(q):
+            fails += 1
+    if fails > 0:
+        print('rademacher is broken.',fails,'values differ from NrParts. Test 6 FAIL')
+    else:
+        print('rademacher works. Test 6 PASS')
+    
+    table = parts.CountTable()
+    fails = 0
+    for q in range(1, 320, 7):
+        for n in range(1, q + 1):
+            if parts.NrParts(q, n) != table.count(q - n, n):
+                fails += 1
+    if fails > 0:
+        print('NrParts is broken.',fails,'values differ from the count table. Test 7 FAIL')
+    else:
+        print('NrParts works. Test 7 PASS')
         
     return
 
@@ -245,6 +452,627 @@ def test_conjugate():
     else:
         print('parts.conjugate() works. Test 4 PASS')
     
+    partition = [150] * 100 + [50] * 100 # conjugated with numpy
+    conjugate = [200] * 50 + [100] * 100
+    conj = parts.conjugate(partition)
+    row = np.zeros(160, dtype=np.int16)
+    parts.conjugate_into(partition, row)
+    if conj != conjugate or row.tolist() != conjugate + [0] * 10:
+        print('parts.conjugate() is broken. Test 5 FAIL')
+    else:
+        print('parts.conjugate() works. Test 5 PASS')
+    
+    return
+
+
+def test_runs():
+    
+    print('\nTesting to ensure that partitions in run-length form match their lists.')
+    q = 30
+    n = 10
+    D = parts.CountTable()
+    fails = 0
+    for rank in range(1, D.count(q - n, n) + 1):
+        partition = parts.multiplicity([n], q - n, D, rank)
+        runs = parts.multiplicity([(n, 1)], q - n, D, rank, runs=True)
+        if parts.from_runs(runs) != partition or parts.to_runs(partition) != runs:
+            fails += 1
+    if fails > 0:
+        print('multiplicity() is broken with runs. Test 1 FAIL')
+    else:
+        print('multiplicity() works with runs. Test 1 PASS')
+    
+    fails = 0
+    for partition in parts.rand_partitions(q, n, 50, 'bottom_up'):
+        runs = parts.to_runs(partition)
+        if parts.from_runs(parts.conjugate_runs(runs)) != parts.conjugate(partition):
+            fails += 1
+    if fails > 0:
+        print('conjugate_runs() is broken. Test 2 FAIL')
+    else:
+        print('conjugate_runs() works. Test 2 PASS')
+    
+    runs = parts.rand_partitions(q, 40, 20, 'multiplicity', zeros=True, runs=True)
+    fails = 0
+    for partition in runs:
+        partition = parts.from_runs(partition)
+        if len(partition) != 40 or sum(partition) != q:
+            fails += 1
+    if fails > 0:
+        print('rand_partitions() is broken with runs. Test 3 FAIL')
+    else:
+        print('rand_partitions() works with runs. Test 3 PASS')
+    
+    partitions = parts.rand_partitions(200, 25, 200, rng=random.Random(10))
+    partitions += [[8] * 25, [176] + [1] * 24, [7], [2, 1], [3, 3, 1, 1]]
+    metrics = [(mt.gini_runs, mt.simplest_gini), (mt.e_var_runs, mt.e_var),
+               (mt.var_runs, np.var), (mt.median_runs, np.median), (mt.skew_runs, stats.skew)]
+    fails = 0
+    for partition in partitions:
+        runs = parts.to_runs(partition)
+        for from_runs, from_list in metrics:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore') # stats.skew() warns of a single run
+                expected = from_list(partition)
+            value = from_runs(runs)
+            if expected != expected: # a single run has no skewness
+                if value == value:
+                    fails += 1
+            elif not np.isclose(value, expected):
+                fails += 1
+    if fails > 0:
+        print('the metrics of partitions in run-length form are broken. Test 4 FAIL')
+    else:
+        print('the metrics of partitions in run-length form work. Test 4 PASS')
+    
+    return
+
+
+def test_unranking():
+    
+    print('\nTesting to ensure that bottom_up() and top_down() map each rank to a distinct member of the feasible set.')
+    q = 20
+    n = 5
+    answer = 84 # there 84 partitions of 20 having 5 parts
+    D = parts.CountTable()
+    bottom = []
+    top = []
+    for rank in range(1, answer + 1):
+        bottom.append(parts.bottom_up([n], q - n, D, rank))
+        top.append(parts.top_down([n], q - n, D, rank))
+    
+    fails = 0
+    for partition in bottom:
+        if sum(partition) != q or len(partition) != n:
+            fails += 1
+    if len(set(tuple(x) for x in bottom)) != answer or fails > 0:
+        print('bottom_up() is broken. Test 1 FAIL')
+    else:
+        print('bottom_up() works. Test 1 PASS')
+    
+    if top != bottom:
+        print('top_down() is broken. Test 2 FAIL')
+    else:
+        print('top_down() works. Test 2 PASS')
+    
+    ranks = sorted(list(range(1, answer + 1)) * 3)
+    batch = parts.batch_bottom_up([n], q - n, n, D, ranks)
+    expected = []
+    for rank in ranks:
+        expected.append(parts.bottom_up([n], q - n, D, rank))
+    if batch != expected:
+        print('batch_bottom_up() is broken. Test 3 FAIL')
+    else:
+        print('batch_bottom_up() works. Test 3 PASS')
+    
+    vectorized = parts.vectorized_bottom_up(q - n, n, np.array(ranks)) + 1
+    if vectorized.tolist() != expected:
+        print('vectorized_bottom_up() is broken. Test 4 FAIL')
+    else:
+        print('vectorized_bottom_up() works. Test 4 PASS')
+    
+    return
+
+
+def test_rng():
+    
+    print('\nTesting to ensure that each method of rand_partitions() gives the same sample from the same rng.')
+    q = 40
+    n = 8
+    names = ['bottom_up', 'top_down', 'divide_and_conquer', 'multiplicity', 'batch', 'vectorized', 'best']
+    fails = 0
+    for name in names:
+        one = parts.rand_partitions(q, n, 50, name, rng=random.Random(3))
+        two = parts.rand_partitions(q, n, 50, name, rng=random.Random(3))
+        if one != two:
+            fails += 1
+        one = parts.rand_partitions(q, n, 50, name, rng=np.random.default_rng(3))
+        two = parts.rand_partitions(q, n, 50, name, rng=np.random.default_rng(3))
+        if one != two:
+            fails += 1
+    if fails > 0:
+        print('rand_partitions() is broken with rng. Test 1 FAIL')
+    else:
+        print('rand_partitions() works with rng. Test 1 PASS')
+    
+    rng = np.random.default_rng(5) # P(550, 50) does not fit in an int64
+    fails = 0
+    for partition in parts.rand_partitions(600, 50, 10, 'bottom_up', rng=rng):
+        if sum(partition) != 600 or len(partition) != 50:
+            fails += 1
+    if fails > 0:
+        print('rand_partitions() is broken with a numpy Generator. Test 2 FAIL')
+    else:
+        print('rand_partitions() works with a numpy Generator. Test 2 PASS')
+    
+    return
+
+
+def test_as_array():
+    
+    print('\nTesting to ensure that rand_partitions() gives the same partitions as an array.')
+    q = 40
+    n = 12
+    names = ['bottom_up', 'top_down', 'divide_and_conquer', 'multiplicity', 'batch', 'vectorized']
+    fails = 0
+    for name in names:
+        for zeros in [False, True]:
+            lists = parts.rand_partitions(q, n, 30, name, zeros=zeros, rng=random.Random(1))
+            array = parts.rand_partitions(q, n, 30, name, zeros=zeros, rng=random.Random(1), as_array=True)
+            if array.shape != (30, n) or array.dtype != np.int8 or array.tolist() != lists:
+                fails += 1
+    if fails > 0:
+        print('rand_partitions() is broken with as_array. Test 1 FAIL')
+    else:
+        print('rand_partitions() works with as_array. Test 1 PASS')
+    
+    return
+
+
+def test_FeasibleSet():
+    
+    print('\nTesting to ensure that FeasibleSet ranks and unranks every member.')
+    q = 20
+    n = 5
+    answer = 84 # there 84 partitions of 20 having 5 parts
+    feasible_set = parts.FeasibleSet(q, n)
+    members = list(feasible_set)
+    fails = 0
+    for i, partition in enumerate(members):
+        if feasible_set.rank(partition) != i or sum(partition) != q or len(partition) != n:
+            fails += 1
+    if len(feasible_set) != answer or len(set(tuple(x) for x in members)) != answer or fails > 0:
+        print('FeasibleSet is broken. Test 1 FAIL')
+    else:
+        print('FeasibleSet works. Test 1 PASS')
+    
+    if feasible_set[10:20] != members[10:20] or feasible_set[-1] != members[-1] or [16, 1, 1, 1, 1] not in feasible_set or [20] in feasible_set:
+        print('FeasibleSet is broken. Test 2 FAIL')
+    else:
+        print('FeasibleSet works. Test 2 PASS')
+    
+    sample = feasible_set.sample(60, rng=random.Random(2))
+    if len(set(tuple(x) for x in sample)) != 60:
+        print('FeasibleSet.sample() is broken. Test 3 FAIL')
+    else:
+        print('FeasibleSet.sample() works. Test 3 PASS')
+    
+    feasible_set = parts.FeasibleSet(1000, 100, zeros=True) # too large to list
+    sample = feasible_set.sample(5, rng=random.Random(2))
+    fails = 0
+    for partition in sample:
+        if feasible_set.unrank(feasible_set.rank(partition)) != partition:
+            fails += 1
+    if fails > 0:
+        print('FeasibleSet is broken. Test 4 FAIL')
+    else:
+        print('FeasibleSet works. Test 4 PASS')
+    
+    return
+
+
+def test_expectations():
+    
+    print('\nTesting to ensure that the expected rank-abundance curve and frequencies match the feasible set.')
+    fails = 0
+    for q, n, zeros in [(20, 5, False), (15, 6, True)]:
+        members = np.array(list(parts.FeasibleSet(q, n, zeros)))
+        curve = parts.expected_abundances(q, n, zeros)
+        freqs = parts.expected_frequencies(q, n, zeros)
+        if not np.allclose(curve, members.mean(axis=0)):
+            fails += 1
+        for j in range(len(freqs)):
+            if not np.isclose(freqs[j], (members == j).sum() / len(members)):
+                fails += 1
+    if fails > 0:
+        print('expected_abundances() or expected_frequencies() is broken. Test 1 FAIL')
+    else:
+        print('expected_abundances() and expected_frequencies() work. Test 1 PASS')
+    
+    return
+
+
+def test_calibrate():
+    
+    print('\nTesting to ensure that method=\'best\' follows a calibration.')
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'calibration.json')
+    grid = [(600, 30, False), (600, 200, True)]
+    parts.calibrate(grid, draws=5, time_limit=0.1, path=path)
+    
+    report = parts.explain(650, 40, path=path)
+    if report['reason'] != 'calibration' or report['method'] not in parts.SAMPLERS:
+        print('explain() is broken. Test 1 FAIL')
+    else:
+        print('explain() works. Test 1 PASS')
+    
+    os.environ['PYPARTITIONS_CALIBRATION'] = path
+    fails = 0
+    for partition in parts.rand_partitions(650, 40, 5, 'best'):
+        if sum(partition) != 650 or len(partition) != 40:
+            fails += 1
+    del os.environ['PYPARTITIONS_CALIBRATION']
+    shutil.rmtree(directory)
+    if fails > 0:
+        print('rand_partitions() is broken with a calibration. Test 2 FAIL')
+    else:
+        print('rand_partitions() works with a calibration. Test 2 PASS')
+    
+    return
+
+
+def test_rand_partitions_many():
+    
+    print('\nTesting to ensure that rand_partitions_many() samples every pair from one table.')
+    pairs = [(60, 12), (20, 5), (300, 10), (40, 40), (250, 200)]
+    D = parts.CountTable()
+    samples = parts.rand_partitions_many(pairs, 20, D=D)
+    fails = 0
+    for q, n in pairs:
+        for partition in samples[(q, n)]:
+            if sum(partition) != q or len(partition) != n or min(partition) < 1:
+                fails += 1
+    if len(samples) != len(pairs) or fails > 0:
+        print('rand_partitions_many() is broken. Test 1 FAIL')
+    else:
+        print('rand_partitions_many() works. Test 1 PASS')
+    
+    one = parts.rand_partitions_many([(40, 8)], 50, rng=random.Random(4))[(40, 8)]
+    two = parts.rand_partitions(40, 8, 50, rng=random.Random(4))
+    if one != two:
+        print('rand_partitions_many() is broken. Test 2 FAIL')
+    else:
+        print('rand_partitions_many() works. Test 2 PASS')
+    
+    return
+
+
+def test_iter_rand_partitions():
+    
+    print('\nTesting to ensure that iter_rand_partitions() streams the sample of rand_partitions() in chunks.')
+    chunks = list(parts.iter_rand_partitions(40, 8, 250, chunk_size=100, rng=random.Random(5), as_array=False))
+    sizes = [len(chunk) for chunk in chunks]
+    if sizes != [100, 100, 50]:
+        print('iter_rand_partitions() is broken. Test 1 FAIL')
+    else:
+        print('iter_rand_partitions() works. Test 1 PASS')
+    
+    streamed = []
+    for chunk in chunks:
+        streamed.extend(chunk)
+    D = parts.CountTable()
+    rng = random.Random(5)
+    whole = []
+    for size in sizes:
+        whole.extend(parts.rand_partitions(40, 8, size, D=D, rng=rng))
+    if streamed != whole:
+        print('iter_rand_partitions() is broken. Test 2 FAIL')
+    else:
+        print('iter_rand_partitions() works. Test 2 PASS')
+    
+    endless = parts.iter_rand_partitions(40, 8, None, chunk_size=10)
+    for i in range(3):
+        chunk = next(endless)
+    if chunk.shape != (10, 8) or chunk.sum() != 400:
+        print('iter_rand_partitions() is broken. Test 3 FAIL')
+    else:
+        print('iter_rand_partitions() works. Test 3 PASS')
+    
+    return
+
+
+def test_parallel_rand_partitions():
+    
+    print('\nTesting to ensure that parallel_rand_partitions() gives the same sample whatever the number of workers.')
+    q = 30
+    n = 6
+    one = parts.parallel_rand_partitions(q, n, 250, 7, workers=1, chunk_size=100)
+    two = parts.parallel_rand_partitions(q, n, 250, 7, workers=2, chunk_size=100)
+    
+    fails = 0
+    for partition in one:
+        if sum(partition) != q or len(partition) != n:
+            fails += 1
+    if len(one) != 250 or fails > 0:
+        print('parallel_rand_partitions() is broken. Test 1 FAIL')
+    else:
+        print('parallel_rand_partitions() works. Test 1 PASS')
+    
+    if one != two:
+        print('parallel_rand_partitions() is broken. Test 2 FAIL')
+    else:
+        print('parallel_rand_partitions() works. Test 2 PASS')
+    
+    cache_dir = tempfile.mkdtemp() # q < n needs the table with zeros
+    sample = parts.parallel_rand_partitions(3, 5, 20, 7, workers=1, cache_dir=cache_dir)
+    fails = 0
+    for partition in sample:
+        if sum(partition) != 3 or len(partition) != 5:
+            fails += 1
+    if fails > 0 or os.listdir(cache_dir) != ['counts_q=3_n=5_zeros=1.bin']:
+        print('parallel_rand_partitions() is broken with cache_dir.',os.listdir(cache_dir),'Test 3 FAIL')
+    else:
+        print('parallel_rand_partitions() works with cache_dir. Test 3 PASS')
+    shutil.rmtree(cache_dir)
+    
+    return
+
+
+def test_kdens():
+    
+    print('\nTesting to ensure that the binned FFT kernel density matches gaussian_kde.')
+    partitions = parts.rand_partitions(300, 30, 2000, as_array=True, rng=np.random.default_rng(1))
+    fails = 0
+    for metric in ['gini', 'evar', 'median', 'variance', 'skewness']:
+        xs, density = mt.get_kdens_obs(partitions, metric)
+        fast_xs, fast = mt.get_kdens_obs(partitions, metric, gridsize=len(xs))
+        if not np.allclose(xs, fast_xs) or np.abs(density - fast).max() > 1e-4 * density.max():
+            fails += 1
+    xs, fast = mt.get_kdens_obs(partitions, 'gini', gridsize=64)
+    if len(xs) != 64 or len(fast) != 64:
+        fails += 1
+    if fails > 0:
+        print('fft_kde() is broken. Test 1 FAIL')
+    else:
+        print('fft_kde() works. Test 1 PASS')
+    
+    flat = [[1] * 30] * 10 # every value equal, as gaussian_kde refuses too
+    try:
+        mt.get_kdens_obs(flat, 'median', gridsize=64)
+        refused = False
+    except np.linalg.LinAlgError:
+        refused = True
+    if not refused:
+        print('fft_kde() is broken. Test 2 FAIL')
+    else:
+        print('fft_kde() works. Test 2 PASS')
+    
+    return
+
+
+def test_metric_arrays():
+    
+    print('\nTesting to ensure that the metrics of a sample array match those of each partition.')
+    partitions = parts.rand_partitions(60, 12, 200, rng=random.Random(6))
+    partitions.append([5] * 12) # equal parts, of skewness NaN
+    array = np.array(partitions)
+    metrics = {'gini': mt.simplest_gini, 'evar': mt.e_var, 'variance': np.var,
+               'skewness': stats.skew, 'median': np.median}
+    arrays = {'gini': mt.gini_array, 'evar': mt.e_var_array, 'variance': mt.var_array,
+              'skewness': mt.skew_array, 'median': mt.median_array}
+    every = mt.compute_all(array)
+    fails = 0
+    for name, metric in metrics.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # stats.skew() warns of the equal parts
+            expected = np.array([metric(partition) for partition in partitions], dtype=float)
+        for values in (every[name], arrays[name](array)):
+            if not np.allclose(values, expected, equal_nan=True):
+                fails += 1
+    if fails > 0:
+        print('compute_all() or the *_array functions are broken. Test 1 FAIL')
+    else:
+        print('compute_all() and the *_array functions work. Test 1 PASS')
+    
+    samples = {'gini': mt.gini_sample, 'evar': mt.Evars_sample, 'variance': mt.vars_sample,
+               'skewness': mt.get_skews, 'median': mt.MDs_sample}
+    fails = 0
+    for name, sample in samples.items():
+        from_array = sample(array)
+        from_list = sample(partitions)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            from_generator = sample(partition for partition in partitions)
+        if len(from_generator) != len(partitions):
+            fails += 1
+        for values in (from_list, from_generator):
+            if not np.allclose(np.array(values, dtype=float), np.array(from_array, dtype=float), equal_nan=True):
+                fails += 1
+    if fails > 0:
+        print('the *_sample functions are broken. Test 2 FAIL')
+    else:
+        print('the *_sample functions work. Test 2 PASS')
+    
+    return
+
+
+def test_accumulators():
+    
+    print('\nTesting to ensure that merging the accumulators of two streams matches streaming them as one.')
+    rng = np.random.default_rng(8)
+    values = rng.normal(size=100000)
+    values[::1000] = np.nan
+    first, second = values[:30000], values[30000:]
+    
+    one = mt.Welford()
+    for chunk in np.array_split(values, 7):
+        one.add_many(chunk)
+    merged = mt.Welford()
+    merged.add_many(first)
+    other = mt.Welford()
+    for x in second[:100]:
+        other.add(x)
+    other.add_many(second[100:])
+    merged.merge(other)
+    finite = values[~np.isnan(values)]
+    if merged.count != one.count or merged.nan != one.nan or one.count != len(finite) or \
+       not np.isclose(merged.mean, finite.mean()) or not np.isclose(merged.variance(), finite.var()) or \
+       not np.isclose(one.variance(), finite.var()):
+        print('Welford.merge() is broken. Test 1 FAIL')
+    else:
+        print('Welford.merge() works. Test 1 PASS')
+    
+    one = mt.Histogram(-2, 2, 40)
+    one.add_many(values)
+    merged = mt.Histogram(-2, 2, 40)
+    merged.add_many(first)
+    other = mt.Histogram(-2, 2, 40)
+    other.add_many(second)
+    merged.merge(other)
+    try:
+        merged.merge(mt.Histogram(-2, 2, 20))
+        refused = False
+    except ValueError:
+        refused = True
+    if (merged.counts != one.counts).any() or merged.under != one.under or \
+       merged.over != one.over or merged.nan != one.nan or not refused:
+        print('Histogram.merge() is broken. Test 2 FAIL')
+    else:
+        print('Histogram.merge() works. Test 2 PASS')
+    
+    k = 200
+    one = mt.QuantileSketch(k, random.Random(1))
+    for chunk in np.array_split(values, 37):
+        one.add_many(chunk)
+    merged = mt.QuantileSketch(k, random.Random(2))
+    merged.add_many(first)
+    other = mt.QuantileSketch(k, random.Random(3))
+    other.add_many(second)
+    merged.merge(other)
+    ordered = np.sort(finite)
+    grid = np.quantile(finite, np.linspace(0.01, 0.99, 99))
+    exact = np.searchsorted(ordered, grid, side='right') / len(finite)
+    fails = 0
+    for sketch in (one, merged):
+        held = 0
+        for level in sketch.levels:
+            held += len(level)
+        ranks = np.searchsorted(ordered, sketch.quantile(np.linspace(0.01, 0.99, 99)), side='right')
+        if sketch.count != len(finite) or sketch.nan != one.nan or held > 4 * k or \
+           np.abs(sketch.cdf(grid) - exact).max() > 2 / k or \
+           np.abs(ranks / len(finite) - np.linspace(0.01, 0.99, 99)).max() > 2 / k:
+            fails += 1
+    if fails > 0:
+        print('QuantileSketch is broken. Test 3 FAIL')
+    else:
+        print('QuantileSketch works. Test 3 PASS')
+    
+    q = 40
+    n = 8
+    members = np.array(list(parts.iter_partitions(q, n)))
+    whole = mt.feasible_set_distributions(q, n, rng=random.Random(4))
+    merged = mt.stream_distributions(members[:1000], q, n, rng=random.Random(5))
+    mt.merge_distributions(merged, mt.stream_distributions(iter(members[1000:]), q, n, block=300,
+                                                           rng=random.Random(6)))
+    fails = 0
+    for name in whole:
+        a = whole[name]
+        b = merged[name]
+        if a['moments'].count != b['moments'].count or a['moments'].nan != b['moments'].nan or \
+           not np.isclose(a['moments'].mean, b['moments'].mean) or \
+           not np.isclose(a['moments'].variance(), b['moments'].variance()) or \
+           (a['histogram'].counts != b['histogram'].counts).any() or \
+           b['quantiles'].count != a['moments'].count:
+            fails += 1
+    if fails > 0:
+        print('merge_distributions() is broken. Test 4 FAIL')
+    else:
+        print('merge_distributions() works. Test 4 PASS')
+    
+    return
+
+
+def test_score_observations():
+    
+    print('\nTesting to ensure that score_observations() gives the percentiles of stats.percentileofscore().')
+    observed = [[10, 5, 3, 2], [7, 7, 1, 1, 1, 1, 1, 1], [9, 6, 3, 2], [12, 12, 12, 12, 12]]
+    scores = mt.score_observations(observed)
+    metrics = {'gini': mt.simplest_gini, 'evar': mt.e_var, 'variance': np.var,
+               'skewness': stats.skew, 'median': np.median}
+    fails = 0
+    for vector, score in zip(observed, scores):
+        q = 0
+        for x in vector:
+            q += x
+        members = list(parts.iter_partitions(q, len(vector)))
+        if score['q'] != q or score['n'] != len(vector) or not score['exact']:
+            fails += 1
+        for name, metric in metrics.items():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore') # stats.skew() warns of equal parts
+                value = metric(vector)
+                reference = [metric(partition) for partition in members]
+            reference = [x for x in reference if x == x] # leave out NaN
+            if value != value:
+                if score[name] == score[name]:
+                    fails += 1
+                continue
+            if abs(score[name] - stats.percentileofscore(reference, value, kind='mean')) > 1e-6:
+                fails += 1
+    if fails > 0:
+        print('score_observations() is broken. Test 1 FAIL')
+    else:
+        print('score_observations() works. Test 1 PASS')
+    
+    rng = np.random.default_rng(3)
+    reference = rng.integers(0, 20, 500).astype(float)
+    values = rng.integers(-2, 23, 50).astype(float)
+    pct = mt._percentiles(reference, values)
+    fails = 0
+    for value, p in zip(values, pct):
+        if abs(p - stats.percentileofscore(reference, value, kind='mean')) > 1e-9:
+            fails += 1
+    if fails > 0:
+        print('score_observations() is broken. Test 2 FAIL')
+    else:
+        print('score_observations() works. Test 2 PASS')
+    
+    # blank lines and rows of zeros are dropped from files, not scored
+    data_dir = tempfile.mkdtemp()
+    csv_path = os.path.join(data_dir, 'observed.csv')
+    with open(csv_path, 'w') as f:
+        f.write('10,5,3,2\n7,7,1,1,1,1,1,1\n\n12,0,4\n0,0\n')
+    npy_path = os.path.join(data_dir, 'observed.npy')
+    np.save(npy_path, np.array([[10, 5, 3, 2], [7, 7, 0, 0], [0, 0, 0, 0]]))
+    from_csv = mt.load_observations(csv_path)
+    from_npy = mt.load_observations(npy_path)
+    csv_scores = mt.score_observations(csv_path)
+    npy_scores = mt.score_observations(npy_path)
+    shutil.rmtree(data_dir)
+    if from_csv != [[10, 5, 3, 2], [7, 7, 1, 1, 1, 1, 1, 1], [12, 4]] or \
+       from_npy != [[10, 5, 3, 2], [7, 7]] or \
+       csv_scores != mt.score_observations(from_csv) or len(npy_scores) != 2 or \
+       npy_scores[0] != scores[0]:
+        print('load_observations() is broken. Test 3 FAIL')
+    else:
+        print('load_observations() works. Test 3 PASS')
+    
+    sampled = mt.score_observations(observed[:3], sample_size=500, exact_max=0,
+                                    rng=random.Random(9))
+    fails = 0
+    for score in sampled:
+        if score['exact'] or not 0 <= score['gini'] <= 100:
+            fails += 1
+    try:
+        mt.score_observations([[3, 2], []])
+        refused = False
+    except ValueError:
+        refused = True
+    if fails > 0 or not refused:
+        print('score_observations() is broken. Test 4 FAIL')
+    else:
+        print('score_observations() works. Test 4 PASS')
+    
     return
 
 
@@ -282,7 +1110,7 @@ def bias_check():
               
         names = ['divide_and_conquer','multiplicity','top_down','bottom_up']
         for name in names:
-            D = {}
+            D = parts.CountTable()
             sample_size = len(sagepartitions)
             
             passes = 0
@@ -317,7 +1145,7 @@ def bias_check():
               
         names = ['divide_and_conquer','multiplicity','top_down','bottom_up']
         for name in names:
-            D = {}
+            D = parts.CountTable()
             sample_size = len(sagepartitions)
             
             passes = 0
@@ -342,24 +1170,35 @@ def bias_check():
     return
     
 
+def shard_members(partitions):
+    """ A reducer for parts.enumerate_partitions(): the members of a shard """
+    
+    return [tuple(x) for x in partitions]
+
+
 def find_all():
     
     print('\nTesting that each random partitioning algorithm can discover the entire feasible set.')
     q = 20
     n = 5
-    answer = 84 # there 84 partitions of 20 having 5 parts
+    members = set()
+    for shard in parts.enumerate_partitions(q, n, shard_members, workers=2):
+        members.update(shard)
+    answer = len(members) # there 84 partitions of 20 having 5 parts
+    if answer != 84:
+        print('enumerate_partitions() is broken. FAIL')
     sample_size = 1000
     names = ['divide_and_conquer','multiplicity','top_down','bottom_up']
     for name in names:
         passtest = 0
         feasibleset = []
-        D = {}
+        D = parts.CountTable()
         while passtest < 1:
             partitions = parts.rand_partitions(q, n, sample_size, name, D, zeros=False)
             partitions = [list(x) for x in set(tuple(x) for x in partitions)]
             feasibleset.extend(partitions)
             feasibleset = [list(x) for x in set(tuple(x) for x in feasibleset)]
-            if len(feasibleset) == answer:
+            if len(feasibleset) == answer and set(tuple(x) for x in feasibleset) == members:
                 print('entire feasible set found using',name,'PASS')
                 passtest +=1
             
@@ -384,10 +1223,28 @@ if __name__ == "__main__":
     test_first_lexical()
     test_last_lexical()
     test_next_restricted_part()
+    test_iter_partitions()
     test_min_max()
     test_P()
+    test_CountTable()
+    test_bounded_CountTable()
+    test_count_table_files()
     test_NrParts()
     test_conjugate()
+    test_runs()
+    test_unranking()
+    test_rng()
+    test_as_array()
+    test_FeasibleSet()
+    test_expectations()
+    test_calibrate()
+    test_rand_partitions_many()
+    test_iter_rand_partitions()
+    test_parallel_rand_partitions()
+    test_kdens()
+    test_metric_arrays()
+    test_accumulators()
+    test_score_observations()
     if test_for_bias:
         bias_check()
     find_all()